@@ -0,0 +1,83 @@
+import json
+from functools import lru_cache
+
+from sqlalchemy import text, DateTime, String, LargeBinary
+
+import read_db
+import utils
+
+# Everything shown when a single advisory is opened: its row, CWEs and affected packages, fetched in
+# one query and kept in an LRU cache per (advisory id, data version). The data only changes with an
+# ingest, so reopening an advisory (or a Dash callback firing twice) doesn't touch the database again
+# beyond the data version lookup.
+
+CACHE_SIZE = 2048 # advisories
+
+# The CWEs and ranges are aggregated in subqueries, joining both to the advisory row would multiply them
+DETAIL_QUERY = text("""
+    SELECT advisory.advisory_id, advisory.cve_id, advisory.severity, advisory.summary,
+           advisory.published, advisory.modified, advisory.withdrawn,
+           (SELECT details FROM advisory_details WHERE advisory_details.advisory_id = advisory.advisory_id) AS details,
+           (SELECT json_group_array(json_object('cwe_id', cwe.cwe_id, 'name', cwe.name))
+            FROM advisory_cwe JOIN cwe ON cwe.cwe_id = advisory_cwe.cwe_id
+            WHERE advisory_cwe.advisory_id = advisory.advisory_id) AS cwes,
+           (SELECT json_group_array(json_object(
+                'ecosystem', package.package_ecosystem, 'name', package.package_name, 'type', affected_range.range_type,
+                'introduced', affected_range.introduced_version, 'fixed', affected_range.fixed_version,
+                'last_affected', affected_range.last_affected_version))
+            FROM affected_range JOIN package ON package.id = affected_range.package_id
+            WHERE affected_range.advisory_id = advisory.advisory_id) AS ranges
+    FROM advisory
+    WHERE advisory.advisory_id = :advisory_id
+""").columns(published=DateTime, modified=DateTime, withdrawn=DateTime, details=LargeBinary, cwes=String, ranges=String)
+
+
+def get_advisory(advisory_id: str) -> dict | None:
+    """The advisory with its CWEs and affected packages, None if there's no such advisory.
+    The result is shared between callers, don't modify it"""
+    return _load(advisory_id, read_db.get_data_version())
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _load(advisory_id: str, data_version: str | None) -> dict | None:
+    # data_version is only part of the cache key: entries of older data are never asked for again
+    # and fall out of the LRU
+    with read_db.get_engine().connect() as conn:
+        row = conn.execute(DETAIL_QUERY, {"advisory_id": advisory_id}).first()
+    if row is None:
+        return None
+
+    packages = {}
+    for affected in sorted(json.loads(row.ranges), key=lambda r: (r['ecosystem'], r['name'])):
+        package = packages.setdefault((affected['ecosystem'], affected['name']),
+                                      {'ecosystem': affected['ecosystem'], 'name': affected['name'], 'ranges': []})
+        package['ranges'].append({key: affected[key] for key in ('type', 'introduced', 'fixed', 'last_affected')})
+
+    return {
+        'advisory_id': row.advisory_id,
+        'cve_id': row.cve_id,
+        'severity': row.severity,
+        'summary': row.summary,
+        'details': utils.decompress_text(row.details),
+        'published': row.published,
+        'modified': row.modified,
+        'withdrawn': row.withdrawn,
+        'cwes': sorted(json.loads(row.cwes), key=lambda cwe: cwe['cwe_id']),
+        'packages': list(packages.values()),
+    }
+
+def cache_info():
+    return _load.cache_info()
+
+def to_json(advisory: dict) -> dict:
+    """The advisory with its timestamps formatted for JSON"""
+    return {name: value.strftime('%Y-%m-%dT%H:%M:%SZ') if hasattr(value, 'strftime') else value
+            for name, value in advisory.items()}
+
+def format_range(affected_range: dict) -> str:
+    """e.g. '>= 1.2.0, < 1.2.5' or '>= 0, <= 2.0.1'"""
+    parts = [f">= {affected_range['introduced'] or '0'}"]
+    if affected_range['fixed']:
+        parts.append(f"< {affected_range['fixed']}")
+    elif affected_range['last_affected']:
+        parts.append(f"<= {affected_range['last_affected']}")
+    return ", ".join(parts)
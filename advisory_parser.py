@@ -0,0 +1,147 @@
+import itertools
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import utils
+from utils import get_path, str_to_date
+
+# This module is imported by the parser worker processes, so keep it free of flask/sqlalchemy imports
+
+BATCH_SIZE = 1000 # Records handed to the database writer at a time
+CHUNK_SIZE = 200 # Files parsed per worker task
+CVE_PATTERN = re.compile(r'CVE-(\d{4})-(\d+)')
+SEVERITY_RANKS = {'LOW': 1, 'MODERATE': 2, 'HIGH': 3, 'CRITICAL': 4} # For sorting by severity, unknown ones rank 0
+
+
+def parse_advisory(value: dict) -> dict:
+    """Normalizes an advisory json document into the record the database writer expects"""
+    packages = []
+    for package in value['affected']:
+        for interval in parse_ranges(package.get('ranges') or []):
+            packages.append({
+                'package_name': package['package']['name'],
+                'package_ecosystem': package['package']['ecosystem'],
+                **interval,
+            })
+
+    cve_id = get_path(value, ['aliases', 0]) # Get the first alias as cve_id
+    cve_match = CVE_PATTERN.match(cve_id) if cve_id else None
+
+    return {
+        'advisory': {
+            'advisory_id': value['id'],
+            'severity': value['database_specific']['severity'],
+            'severity_rank': SEVERITY_RANKS.get(value['database_specific']['severity'], 0),
+            'summary': value['summary'],
+            'cve_id': cve_id,
+            'cve_year': int(cve_match.group(1)) if cve_match else None,
+            'cve_number': int(cve_match.group(2)) if cve_match else None,
+            'published': str_to_date(value['published']),
+            'modified': str_to_date(value['modified']),
+            'withdrawn': str_to_date(value.get('withdrawn')), # Get withdrawn date if exists
+        },
+        'details': value['details'],
+        'cwe_ids': [int(cwe[4:]) for cwe in value['database_specific']['cwe_ids']], # Strip the "CWE-" prefix
+        'packages': utils.remove_duplicates(packages, key=package_identity),
+    }
+
+def parse_ranges(ranges: list) -> list[dict]:
+    """Flattens OSV ranges into affected intervals. Events are read in order, an "introduced" opens an
+    interval and the next "fixed" or "last_affected" closes it (a range can hold several intervals)"""
+    intervals = []
+    for version_range in ranges:
+        current = None
+        for event in version_range.get('events', []):
+            if 'introduced' in event:
+                if current is not None:
+                    intervals.append(current)
+                current = {'range_type': version_range.get('type'), 'introduced_version': event['introduced'],
+                           'fixed_version': None, 'last_affected_version': None}
+            elif current is not None and ('fixed' in event or 'last_affected' in event):
+                current['fixed_version'] = event.get('fixed')
+                current['last_affected_version'] = event.get('last_affected')
+                intervals.append(current)
+                current = None
+        if current is not None:
+            intervals.append(current)
+
+    if not intervals:
+        # Keep the package listed even when the advisory has no usable range
+        intervals.append({'range_type': None, 'introduced_version': None,
+                          'fixed_version': None, 'last_affected_version': None})
+    return intervals
+
+def package_identity(package: dict) -> tuple:
+    return (package['package_ecosystem'], package['package_name'], package['range_type'],
+            package['introduced_version'], package['fixed_version'], package['last_affected_version'])
+
+def parse_files(json_files: list[str]) -> tuple[list[dict], dict]:
+    """Worker task: reads and normalizes a chunk of advisory files.
+    Also returns what it read and how long reading and parsing took (see new_stats)"""
+    records = []
+    stats = new_stats()
+    for json_file in json_files:
+        started = time.perf_counter()
+        with open(json_file, 'rb') as f:
+            content = f.read()
+        read = time.perf_counter()
+        records.append(parse_advisory(json.loads(content)))
+
+        stats['files'] += 1
+        stats['bytes'] += len(content)
+        stats['read_seconds'] += read - started
+        stats['parse_seconds'] += time.perf_counter() - read
+    return records, stats
+
+def new_stats() -> dict:
+    return {'files': 0, 'bytes': 0, 'read_seconds': 0.0, 'parse_seconds': 0.0}
+
+def add_stats(total: dict | None, stats: dict):
+    if total is not None:
+        for key, value in stats.items():
+            total[key] += value
+
+def iter_advisory_batches(json_files, batch_size: int = BATCH_SIZE, workers: int | None = None,
+                          stats: dict | None = None):
+    """Parses the advisory files in a process pool and yields lists of at most `batch_size` records.
+    Only a couple of chunks per worker are in flight at once, so memory stays bounded by the batch
+    size rather than by the number of files. The workers' read/parse stats are added to `stats`
+    (a new_stats() dict) if given"""
+    workers = workers or os.cpu_count() or 1
+    tasks = utils.chunks(json_files, CHUNK_SIZE)
+
+    first = next(tasks, None)
+    if first is None:
+        return
+    if len(first) < CHUNK_SIZE:
+        # Not worth starting a pool for a handful of files (e.g. a small incremental update)
+        records, chunk_stats = parse_files(first)
+        add_stats(stats, chunk_stats)
+        yield from utils.chunks(records, batch_size)
+        return
+
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(parse_files, first)}
+        for chunk in itertools.islice(tasks, workers * 2 - 1):
+            pending.add(executor.submit(parse_files, chunk))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                records, chunk_stats = future.result()
+                add_stats(stats, chunk_stats)
+                batch.extend(records)
+                chunk = next(tasks, None)
+                if chunk is not None:
+                    pending.add(executor.submit(parse_files, chunk))
+
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+
+    if batch:
+        yield batch
@@ -1,12 +1,15 @@
-import sys
+import time
+STARTED_AT = time.perf_counter() # Taken before the other imports, for the time-to-first-response report
 
-from flask import Flask
-from database import init_or_update_db
-from flask_apscheduler import APScheduler
+import argparse
+import threading
 
 from flask import Flask
-from database import init_or_update_db
+from database import init_schema
 import helpers
+import snapshot
+import utils
+import worker
 from flask_apscheduler import APScheduler
 
 app = Flask(__name__)
@@ -17,24 +20,45 @@ app.config['SQLALCHEMY_DATABASE_URI']= 'sqlite:///advisory.db'
 scheduler = APScheduler()
 
 from routes import *
+import cli
 
 @scheduler.task('cron', id='update_database', hour=3, minute=0) # Every day at 3:00 AM
 def update_all() -> bool:
-    with scheduler.app.app_context():
-        return init_or_update_db()
+    # The update runs in its own process (see worker.py), this thread only waits for it
+    return worker.run_in_subprocess()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no-update', action='store_true', help="Serve the current data without updating it first")
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help="Bootstrap from a database snapshot (see `flask --app app export-snapshot`), "
+                             "skipping the clone and parse on start")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        header = snapshot.read_header(args.snapshot)
+        if snapshot.is_newer_than_db(header):
+            print(f"Importing snapshot {args.snapshot} (commit {header['last_commit']}, {header['data_updated_at']})...")
+            try:
+                snapshot.import_snapshot(args.snapshot)
+            except ValueError as e:
+                raise SystemExit(f"Couldn't import the snapshot: {e}")
+        else:
+            print("Local database is as new as the snapshot, keeping it.")
+
     with app.app_context():
         db.init_app(app)
-        db.create_all()
-        if len(sys.argv) > 1 and sys.argv[1] == '--no-update':
-            print("Skipping database update... (because of --no-update)\n")
-        else:
-            init_or_update_db()
-            
+        init_schema()
+
+    scheduler.init_app(app)
+    scheduler.start()
 
-        scheduler.init_app(app)
-        scheduler.start()
+    if args.no_update or args.snapshot:
+        print(f"Skipping database update... (because of {'--no-update' if args.no_update else '--snapshot'})\n")
+    else:
+        # The refresh (git pull + ingest) runs in the background, the current data is served meanwhile
+        threading.Thread(target=update_all, name='initial-update', daemon=True).start()
 
+    utils.report_first_response(app, STARTED_AT, "app")
     app.run()
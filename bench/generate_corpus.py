@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+# Writes a fake but realistic advisory corpus for offline benchmarks: a git repo shaped like
+# github/advisory-database (advisories/github-reviewed/YYYY/MM/GHSA-.../GHSA-....json, OSV format)
+# and a CWE catalogue xml. Package popularity and CWE usage are skewed the way the real data is,
+# a few packages and weaknesses account for most advisories.
+#
+#   python bench/generate_corpus.py bench/corpus --advisories 50000
+#
+# The output directory gets advisory-database/ and cwe_list.xml, the same layout as data/.
+
+ECOSYSTEMS = {'npm': 30, 'PyPI': 15, 'Maven': 20, 'Go': 12, 'Packagist': 8, 'RubyGems': 5, 'NuGet': 5,
+              'crates.io': 4, 'Pub': 1}
+SEVERITIES = {'LOW': 10, 'MODERATE': 40, 'HIGH': 35, 'CRITICAL': 15}
+WORDS = ("remote attacker arbitrary code execution crafted request denial service memory corruption path traversal "
+         "prototype pollution cross site scripting injection sql command deserialization untrusted input buffer "
+         "overflow authentication bypass privilege escalation sensitive information exposure regular expression "
+         "server side request forgery improper validation header parsing cookie session token redirect upload "
+         "archive extraction symlink race condition integer underflow null pointer dereference template sandbox").split()
+GHSA_ALPHABET = '23456789cfghjmpqrvwx'
+NS = 'http://cwe.mitre.org/cwe-7'
+
+
+def ghsa_id(rng: random.Random) -> str:
+    return 'GHSA-' + '-'.join(''.join(rng.choice(GHSA_ALPHABET) for _ in range(4)) for _ in range(3))
+
+def sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def package_name(rng: random.Random, ecosystem: str, index: int) -> str:
+    base = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}-{index}"
+    if ecosystem == 'Maven':
+        return f"org.{rng.choice(WORDS)}:{base}"
+    if ecosystem == 'Go':
+        return f"github.com/{rng.choice(WORDS)}/{base}"
+    if ecosystem == 'Packagist':
+        return f"{rng.choice(WORDS)}/{base}"
+    if ecosystem == 'npm' and index % 5 == 0:
+        return f"@{rng.choice(WORDS)}/{base}"
+    return base
+
+def next_version(rng: random.Random, after: tuple | None) -> tuple:
+    """A (major, minor, patch) later than `after`, mostly a patch or minor bump like real fix releases"""
+    if after is None:
+        return rng.randint(0, 12), rng.randint(0, 30), rng.randint(0, 20)
+    major, minor, patch = after
+    roll = rng.random()
+    if roll < 0.6:
+        return major, minor, patch + rng.randint(1, 5)
+    if roll < 0.9:
+        return major, minor + rng.randint(1, 3), rng.randint(0, 5)
+    return major + rng.randint(1, 2), rng.randint(0, 5), rng.randint(0, 5)
+
+def format_version(ecosystem: str, version: tuple) -> str:
+    prefix = 'v' if ecosystem == 'Go' else ''
+    return prefix + '.'.join(map(str, version))
+
+def ranges(rng: random.Random, ecosystem: str) -> list[dict]:
+    """One or two intervals in increasing order, mostly introduced/fixed, sometimes open or closed by
+    last_affected. An open interval is always the last one"""
+    events = []
+    current = None
+    for i in range(1 if rng.random() < 0.85 else 2):
+        if i == 0 and rng.random() < 0.5:
+            events.append({'introduced': '0'})
+        else:
+            current = next_version(rng, current)
+            events.append({'introduced': format_version(ecosystem, current)})
+        roll = rng.random()
+        if roll >= 0.95:
+            break # Still affected
+        current = next_version(rng, current)
+        events.append({'fixed' if roll < 0.85 else 'last_affected': format_version(ecosystem, current)})
+    return [{'type': 'SEMVER' if ecosystem in ('npm', 'Go', 'crates.io') else 'ECOSYSTEM', 'events': events}]
+
+def make_advisory(rng: random.Random, index: int, packages: list, cwe_ids: list, start: datetime) -> dict:
+    published = start + timedelta(seconds=rng.randint(0, 10 * 365 * 86400))
+    modified = published + timedelta(days=rng.randint(0, 700))
+    severity = rng.choices(list(SEVERITIES), weights=list(SEVERITIES.values()))[0]
+
+    affected = []
+    for ecosystem, name in {tuple(pkg) for pkg in rng.choices(packages, k=rng.choices([1, 2, 3], [80, 15, 5])[0])}:
+        affected.append({'package': {'ecosystem': ecosystem, 'name': name}, 'ranges': ranges(rng, ecosystem)})
+
+    advisory = {
+        'schema_version': '1.4.0',
+        'id': ghsa_id(rng),
+        'modified': modified.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'published': published.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'aliases': [f"CVE-{published.year}-{10000 + index}"] if rng.random() < 0.8 else [],
+        'summary': sentence(rng, rng.randint(4, 12)).capitalize(),
+        'details': '\n\n'.join(sentence(rng, rng.randint(20, 80)) for _ in range(rng.randint(1, 8))),
+        'severity': [{'type': 'CVSS_V3', 'score': 'CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H'}],
+        'affected': affected,
+        'references': [{'type': 'WEB', 'url': f"https://example.com/advisories/{index}"}],
+        'database_specific': {
+            'cwe_ids': [f"CWE-{cwe}" for cwe in sorted(set(rng.choices(cwe_ids, k=rng.choices([0, 1, 2, 3], [10, 60, 25, 5])[0])))],
+            'severity': severity,
+            'github_reviewed': True,
+            'github_reviewed_at': modified.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'nvd_published_at': None,
+        },
+    }
+    if rng.random() < 0.01:
+        advisory['withdrawn'] = modified.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return advisory
+
+def write_cwe_list(path: str, cwe_ids: list[int], rng: random.Random):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<Weakness_Catalog xmlns="{NS}" Name="CWE" Version="4.14">\n<Weaknesses>\n')
+        for cwe_id in cwe_ids:
+            f.write(f'<Weakness ID="{cwe_id}" Name="{sentence(rng, 4).title()}" Abstraction="Base" Status="Stable">'
+                    f'<Description>{sentence(rng, 30)}</Description></Weakness>\n')
+        f.write('</Weaknesses>\n</Weakness_Catalog>\n')
+
+def generate(out_dir: str, advisories: int, packages: int, cwes: int, seed: int):
+    rng = random.Random(seed)
+    repo = os.path.join(out_dir, 'advisory-database')
+    if os.path.exists(repo):
+        raise SystemExit(f"{repo} already exists, pick an empty output directory")
+    os.makedirs(repo)
+
+    ecosystems = rng.choices(list(ECOSYSTEMS), weights=list(ECOSYSTEMS.values()), k=packages)
+    all_packages = [(ecosystem, package_name(rng, ecosystem, i)) for i, ecosystem in enumerate(ecosystems)]
+    # Zipf-like: the package (and CWE) at rank r is picked with weight 1/r
+    package_weights = [1 / rank for rank in range(1, packages + 1)]
+    all_cwes = sorted(rng.sample(range(1, 1500), cwes))
+    cwe_weights = [1 / rank for rank in range(1, cwes + 1)]
+    # Also list a few CWEs the catalogue doesn't have, the ingest has to cope with those
+    catalogue = all_cwes[:max(1, cwes - max(1, cwes // 50))]
+
+    start = datetime(2015, 1, 1)
+    used_ids = set()
+    for i in range(advisories):
+        picked_packages = rng.choices(all_packages, weights=package_weights, k=3)
+        picked_cwes = rng.choices(all_cwes, weights=cwe_weights, k=3)
+        advisory = make_advisory(rng, i, picked_packages, picked_cwes, start)
+        while advisory['id'] in used_ids:
+            advisory['id'] = ghsa_id(rng)
+        used_ids.add(advisory['id'])
+
+        published = advisory['published']
+        folder = os.path.join(repo, 'advisories', 'github-reviewed', published[:4], published[5:7], advisory['id'])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, advisory['id'] + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(advisory, f, indent=2)
+        if (i + 1) % 10000 == 0:
+            print(f"{i + 1} advisories written")
+
+    write_cwe_list(os.path.join(out_dir, 'cwe_list.xml'), catalogue, rng)
+
+    print("Committing the corpus...")
+    git = ['git', '-c', 'user.name=corpus', '-c', 'user.email=corpus@localhost']
+    subprocess.run(['git', 'init', '-q', '-b', 'main'], cwd=repo, check=True)
+    subprocess.run(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=repo, check=True) # For blobless clones
+    subprocess.run(['git', 'add', '-A'], cwd=repo, check=True)
+    subprocess.run(git + ['commit', '-q', '-m', f"Synthetic corpus: {advisories} advisories, seed {seed}"],
+                   cwd=repo, check=True)
+
+    with open(os.path.join(out_dir, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump({'advisories': advisories, 'packages': packages, 'cwes': cwes, 'seed': seed}, f)
+    print(f"Corpus written to {out_dir}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generates a synthetic advisory corpus for benchmarks")
+    parser.add_argument('out_dir')
+    parser.add_argument('--advisories', type=int, default=10000)
+    parser.add_argument('--packages', type=int, help="Distinct packages (default: a third of the advisories)")
+    parser.add_argument('--cwes', type=int, default=400, help="Distinct CWEs referenced (at most 1499)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not 0 < args.cwes < 1500:
+        sys.exit("--cwes must be between 1 and 1499")
+    generate(args.out_dir, args.advisories, args.packages or max(1, args.advisories // 3), args.cwes, args.seed)
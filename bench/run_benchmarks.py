@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Times the ingest, the list/filter helpers, the search bar queries and the chart routes against a
+# corpus from generate_corpus.py, and saves the results as JSON so runs can be compared between commits.
+#
+#   python bench/run_benchmarks.py bench/corpus --out bench/results/$(git rev-parse --short HEAD).json
+#   python bench/run_benchmarks.py bench/corpus --compare bench/results/abc1234.json
+#
+# Everything runs in a scratch directory (--workdir), the corpus repo is synced from like a mirror.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGRESSION_RATIO = 1.2 # a median this much slower than the baseline is flagged...
+REGRESSION_MIN_MS = 0.5 # ...if it's also slower by this much (sub-millisecond timings are mostly noise)
+
+
+def summarize(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0] * 1000, 3),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+def measure(results: dict, name: str, func, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    results[name] = summarize(samples)
+    print(f"{name:45} median {results[name]['median_ms']:10.3f} ms  p95 {results[name]['p95_ms']:10.3f} ms")
+
+def project_commit() -> dict:
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=PROJECT_ROOT, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+def run(corpus_dir: str, repeat: int, ingest_repeat: int) -> dict:
+    # The app resolves its data and instance paths relative to the working directory
+    os.makedirs('data', exist_ok=True)
+    shutil.copy(os.path.join(corpus_dir, 'cwe_list.xml'), os.path.join('data', 'cwe_list.xml'))
+    os.environ['ADVISORY_REPO_URL'] = os.path.join(corpus_dir, 'advisory-database')
+    sys.path.insert(0, PROJECT_ROOT)
+
+    import database
+    import metrics
+    import read_db
+    from sqlalchemy import text
+
+    results = {}
+    print("Ingest")
+    measure(results, 'update_db (clone + full ingest)', database.update_db, 1)
+    first_run = metrics.last_run()
+    measure(results, 'update_db (nothing changed)', database.update_db, repeat)
+
+    def reload_all():
+        with database.shadow_database() as conn:
+            database.set_meta(conn, 'cwe_hash', '') # Forces the CWE reload
+            started = time.perf_counter()
+            database.load_cwe_data(conn)
+            cwe_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            database.load_repo_data(conn, full=True)
+            repo_samples.append(time.perf_counter() - started)
+    cwe_samples, repo_samples = [], []
+    measure(results, 'shadow rebuild (copy, reload, swap)', reload_all, ingest_repeat)
+    results['load_cwe_data'] = summarize(cwe_samples)
+    results['load_repo_data (full)'] = summarize(repo_samples)
+    for name in ('load_cwe_data', 'load_repo_data (full)'):
+        print(f"{name:45} median {results[name]['median_ms']:10.3f} ms")
+
+    import helpers
+    with read_db.get_session() as session:
+        sample_id, popular_name, popular_ecosystem = session.execute(text(
+            "SELECT affected_range.advisory_id, package.package_name, package.package_ecosystem "
+            "FROM package JOIN affected_range ON affected_range.package_id = package.id "
+            "GROUP BY package.id ORDER BY COUNT(*) DESC LIMIT 1")).one()
+        sample_cve = session.execute(text("SELECT cve_id FROM advisory WHERE cve_id IS NOT NULL LIMIT 1")).scalar()
+
+    print("helpers.filterCVEs")
+    second_page = helpers.filterCVEs({})['next_cursor']
+    for name, filters, cursor in (
+        ('first page', {}, None),
+        ('second page', {}, second_page),
+        ('severity HIGH by published desc', {'severity': 'high', 'orderBy': 'published', 'order': 'desc'}, None),
+        ('ecosystem npm by cve_id', {'ecosystem': 'npm', 'orderBy': 'cve_id'}, None),
+        ('most affected project', {'projectName': popular_name, 'ecosystem': popular_ecosystem}, None),
+        ('published in 2020', {'publishedFrom': '2020-01-01', 'publishedTo': '2020-12-31'}, None),
+    ):
+        measure(results, f"filterCVEs: {name}", lambda: helpers.filterCVEs(filters, cursor), repeat)
+    measure(results, 'getProjectCVEs: first page', helpers.getProjectCVEs, repeat)
+
+    print("Search bar")
+    import gui_search_bar
+    import prefix_index
+    measure(results, 'prefix_index.build_index', prefix_index.build_index, max(1, repeat // 10))
+    prefix_index.get_index()
+    measure(results, 'prefix search: CVE year', lambda: prefix_index.search(sample_cve[:9]), repeat)
+    measure(results, 'prefix search: advisory id', lambda: prefix_index.search(sample_id[:7]), repeat)
+    measure(results, 'full-text search', lambda: gui_search_bar.get_text_data('path traversal'), repeat)
+    measure(results, 'advisory lookup', lambda: gui_search_bar.get_data(sample_id), repeat)
+
+    print("Routes")
+    from app import app
+    client = app.test_client()
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+
+    current_year = datetime.now(timezone.utc).year
+    chart_url = f"/charts/cve-trend/{current_year - 9}-{current_year}.png"
+    measure(results, '/cve-trend chart (first render)', lambda: get(chart_url), 1)
+    measure(results, '/cve-trend chart (cached)', lambda: get(chart_url), repeat)
+    measure(results, '/cve-trend', lambda: get('/cve-trend'), repeat)
+    measure(results, '/top-10-cwes', lambda: get('/top-10-cwes'), repeat)
+
+    return {'benchmarks': results, 'initial_ingest_stages': first_run.get('stages', {}),
+            'initial_ingest_rows': first_run.get('rows_written', {})}
+
+def compare(current: dict, baseline: dict) -> bool:
+    """Prints the median change of every benchmark in both runs, returns False if any regressed"""
+    ok = True
+    print(f"\nCompared to {baseline['project']['commit'][:12]} ({baseline['created_at']})")
+    for name, result in current['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None or not old['median_ms']:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        flag = ''
+        if ratio > REGRESSION_RATIO and result['median_ms'] - old['median_ms'] > REGRESSION_MIN_MS:
+            flag, ok = '  REGRESSION', False
+        print(f"{name:45} {old['median_ms']:10.3f} -> {result['median_ms']:10.3f} ms  x{ratio:.2f}{flag}")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks ingest and queries against a synthetic corpus")
+    parser.add_argument('corpus_dir', help="Output directory of generate_corpus.py")
+    parser.add_argument('--workdir', help="Scratch directory (default: a new temporary one, removed afterwards)")
+    parser.add_argument('--repeat', type=int, default=20, help="Runs per query benchmark")
+    parser.add_argument('--ingest-repeat', type=int, default=1, help="Runs of the full rebuild benchmark")
+    parser.add_argument('--out', help="Write the results to this JSON file")
+    parser.add_argument('--compare', metavar='JSON', help="Results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.abspath(args.corpus_dir)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='advisory-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    try:
+        with open(os.path.join(corpus_dir, 'corpus.json'), encoding='utf-8') as f:
+            corpus = json.load(f)
+        report = {
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'project': project_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': corpus,
+            **run(corpus_dir, args.repeat, args.ingest_repeat),
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if out:
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {out}")
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            if not compare(report, json.load(f)):
+                sys.exit(1)
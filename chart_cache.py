@@ -0,0 +1,66 @@
+import hashlib
+import io
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import read_db
+
+# Rendered charts, kept per (chart, parameters, data version). The data changes at most once a day,
+# so a chart is drawn once after each ingest and then served from memory with an ETag.
+
+Chart = namedtuple('Chart', ['png', 'etag', 'last_modified'])
+
+MAX_CHARTS = 64
+
+_charts = {}
+_lock = threading.Lock()
+
+
+def get_chart(name: str, params: tuple, render) -> Chart:
+    """Returns the cached chart for the current data, calling `render()` (which returns PNG bytes)
+    only if it hasn't been drawn since the last ingest"""
+    meta = read_db.get_meta('data_version', 'data_updated_at')
+    key = (name, params, meta.get('data_version'))
+
+    chart = _charts.get(key)
+    if chart is None:
+        with _lock:
+            chart = _charts.get(key)
+            if chart is None:
+                png = render()
+                chart = Chart(png, hashlib.sha1(png).hexdigest(), parse_timestamp(meta.get('data_updated_at')))
+                # Charts drawn from older data won't be asked for again
+                for old_key in [old_key for old_key in _charts if old_key[2] != key[2]]:
+                    del _charts[old_key]
+                if len(_charts) >= MAX_CHARTS:
+                    del _charts[next(iter(_charts))] # The oldest one, dicts keep insertion order
+                _charts[key] = chart
+    return chart
+
+def render_bar_chart(x: list, y: list, title: str, xlabel: str, ylabel: str) -> bytes:
+    """Draws a bar chart to PNG with matplotlib's object-oriented API. It doesn't touch the global
+    pyplot state, so it's safe to call from several request threads at once"""
+    # Imported here so processes that never draw a chart don't pay for matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bar(x, y, color='#3478c0')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(x)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+def parse_timestamp(value: str | None) -> datetime | None:
+    if value is None:
+        return None
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
@@ -0,0 +1,86 @@
+import json
+import os
+
+import click
+
+from app import app
+import depscan
+import export
+import read_db
+import snapshot
+
+# Command line entry points, e.g. flask --app app scan requirements.txt
+
+
+@app.cli.command('scan')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(list(depscan.PARSERS)),
+              help="Dependency file format, guessed from the file name or content by default")
+@click.option('--json', 'as_json', is_flag=True, help="Print the full result as JSON")
+def scan_command(path, file_format, as_json):
+    """Lists the dependencies in PATH (requirements.txt, package-lock.json or a CycloneDX SBOM)
+    affected by a known advisory"""
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    try:
+        dependencies = depscan.parse_dependencies(content, path, file_format)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    with read_db.get_session() as session:
+        result = depscan.scan(session, dependencies)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    for entry in result['vulnerable']:
+        click.echo(f"{entry['ecosystem']} {entry['name']} {entry['version']}")
+        for advisory in entry['advisories']:
+            fixed = f"fixed in {advisory['fixed_version']}" if advisory['fixed_version'] else "no fix"
+            click.echo(f"    {advisory['advisory_id']} {advisory['cve_id'] or ''} {advisory['severity']} ({fixed})")
+    click.echo(f"{len(result['vulnerable'])} of {result['dependencies']} dependencies are vulnerable"
+               f", {len(result['skipped'])} skipped")
+    if result['vulnerable']:
+        raise SystemExit(1)
+
+@app.cli.command('export-snapshot')
+@click.argument('path', type=click.Path(dir_okay=False))
+def export_snapshot_command(path):
+    """Writes a compressed snapshot of the ingested database to PATH, for `python app.py --snapshot PATH`"""
+    header = snapshot.export_snapshot(path)
+    click.echo(f"Snapshot of commit {header['last_commit']} (data version {header['data_version']}) written to {path}, "
+               f"{header['size'] // 1024} KiB database, {os.path.getsize(path) // 1024} KiB compressed")
+
+@app.cli.command('import-snapshot')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--force', is_flag=True, help="Import even if the local database is newer")
+def import_snapshot_command(path, force):
+    """Replaces the local database with the snapshot at PATH (stop the app first)"""
+    try:
+        header = snapshot.read_header(path)
+        if not force and not snapshot.is_newer_than_db(header):
+            raise click.ClickException("The local database is as new as the snapshot, use --force to import anyway")
+        snapshot.import_snapshot(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Imported snapshot of commit {header['last_commit']} ({header['data_updated_at']})")
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(list(export.DATASETS)))
+@click.option('--format', 'file_format', type=click.Choice(list(export.FORMATS)), default='ndjson', show_default=True)
+@click.option('--modified-since', help="Only advisories modified since this date/time (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SSZ)")
+@click.option('--severity', help="Only advisories of this severity")
+@click.option('--ecosystem', help="Only advisories (or ranges) affecting this ecosystem")
+@click.option('--exclude-withdrawn', is_flag=True, help="Leave withdrawn advisories out")
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), help="Write to a file instead of stdout")
+def export_command(dataset, file_format, modified_since, severity, ecosystem, exclude_withdrawn, output):
+    """Streams DATASET (advisories, affected or cwes) as NDJSON or CSV"""
+    try:
+        filters = export.parse_filters({'modified_since': modified_since, 'severity': severity, 'ecosystem': ecosystem,
+                                        'include_withdrawn': not exclude_withdrawn})
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    with click.open_file(output or '-', 'w', encoding='utf-8') as out:
+        for chunk in export.stream(dataset, file_format, filters):
+            out.write(chunk)
@@ -1,171 +1,392 @@
 import glob
-import json
 import os
-import subprocess
+import sqlite3
 import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text,case,func
+from sqlalchemy import text,func,select,insert,create_engine,event
+from sqlalchemy.pool import NullPool
 
+import fts
+import metrics
+import read_db
+import rollups
 import utils
-from utils import get_path, str_to_date
+import versions
+import worker
+from advisory_parser import iter_advisory_batches, new_stats
+from repo_sync import DATA_PATH, REPO_PATH, ADVISORY_DIR, repo_exists, update_repo, get_repo_head, get_changed_files
 import xml.etree.ElementTree as ET
 
-db = SQLAlchemy()
+from models import db, Cwe, Advisory, AdvisoryDetails, Package, AffectedRange, Meta, advisory_cwe
 
-from models import Cwe, Advisory, Package
-
-REPO_URL = 'https://github.com/github/advisory-database.git'
-DATA_PATH = 'data'
-#os.path.join is to ensure crossplatform compatibility
-REPO_PATH = os.path.join(DATA_PATH, 'advisory-database')
-DB_PATH = os.path.join(DATA_PATH, 'advisory.db')
+DB_PATH = read_db.DB_FILE
+# The ingest builds the next version of the database here, it replaces DB_PATH once it's complete
+SHADOW_PATH = DB_PATH + '.shadow'
 CWE_PATH = os.path.join(DATA_PATH, 'cwe_list.xml')
-
-
-def init_or_update_db() -> bool:
+# Bump this whenever models.py changes, the tables are then rebuilt from scratch on the next start
+SCHEMA_VERSION = '10'
+SWAP_TIMEOUT = 60 # seconds the swap keeps retrying while readers hold the database open (Windows only)
+
+
+def init_schema():
+    """Makes sure the database exists with the current schema. If it was made by an older schema
+    an empty database is swapped in, the next ingest fills it. The rebuild holds the update lock, so
+    it never runs next to a worker (see worker.py); if one is running, the rebuild is left to it"""
+    if read_db.get_meta('schema_version').get('schema_version') == SCHEMA_VERSION:
+        return
+
+    lock = worker.acquire_lock()
+    if lock is None:
+        print("Database schema changed, but an update is running, it rebuilds the tables.")
+        return
     try:
-        load_cwe_data()
-        if update_repo():
-            load_repo_data()
+        if read_db.get_meta('schema_version').get('schema_version') != SCHEMA_VERSION: # The worker may have just done it
+            print("Database schema changed, rebuilding the tables...")
+            with shadow_database():
+                pass
+    finally:
+        lock.close()
+
+def update_db(progress=None) -> bool:
+    """Syncs the advisory repo and rebuilds the database if anything changed (returns whether it did), raising on failure.
+    `progress(stage, advisories_written)` is called as the run moves through its stages.
+    Every run's timings and counters are recorded, see metrics.py"""
+    progress = progress or (lambda stage, advisories_written=None: None)
+    metrics.start_run()
+    try:
+        progress('sync')
+        with metrics.stage('git_sync'):
+            update_repo()
+        with metrics.stage('check'):
+            changed = needs_update()
+        if changed:
+            # Readers keep using the current file until the new one is complete
+            with shadow_database() as conn:
+                progress('cwe')
+                cwes_reloaded = load_cwe_data(conn)
+                progress('advisories')
+                # Compares the checked out commit with the last ingested one, so it's a no-op when nothing changed.
+                # A new CWE list needs every advisory relinked though: the links only exist for CWEs the list knew
+                load_repo_data(conn, full=cwes_reloaded, progress=progress)
+                progress('swap')
     except Exception as e:
-        print(f"{e}", file=sys.stderr)
-        return False
+        metrics.finish_run(False, str(e))
+        raise
 
-    return True
+    metrics.count('database_rebuilt', int(changed))
+    metrics.finish_run(True)
+    return changed
 
-def load_cwe_data():
+def needs_update() -> bool:
+    """Whether the CWE list, the advisory repo or the schema changed since the live database was built"""
+    meta = read_db.get_meta('schema_version', 'cwe_hash', 'last_commit')
+    if meta.get('schema_version') != SCHEMA_VERSION:
+        return True
+    if cwe_list_exists() and utils.file_sha256(CWE_PATH) != meta.get('cwe_hash'):
+        return True
+    return not repo_exists() or get_repo_head() != meta.get('last_commit')
+
+def _tune_shadow_connection(dbapi_connection, _):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=DELETE") # The live file is only ever read, it needs no WAL
+    cursor.execute("PRAGMA synchronous=OFF") # Nothing reads the shadow until it's synced and swapped in
+    cursor.close()
+
+@contextmanager
+def shadow_database():
+    """Yields a connection (in a transaction) to a copy of the live database. When the block succeeds
+    the copy is validated and renamed over the live file, so readers see either the old or the new
+    data and never wait on the ingest. If the live database has an older schema, the copy starts empty.
+    Only call it while holding the update lock (worker.acquire_lock): it deletes any shadow file it finds"""
+    for path in (SHADOW_PATH, SHADOW_PATH + '-journal'):
+        if os.path.exists(path):
+            os.remove(path) # Left over from a crashed run
+    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+
+    live_meta = read_db.get_meta('schema_version', 'data_version')
+    rebuild = live_meta.get('schema_version') != SCHEMA_VERSION
+    if not rebuild:
+        # VACUUM INTO makes a compact, consistent copy without blocking the readers
+        with metrics.stage('copy'):
+            source = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+            try:
+                source.execute("VACUUM INTO ?", (SHADOW_PATH,))
+            finally:
+                source.close()
+
+    engine = create_engine("sqlite:///" + SHADOW_PATH, poolclass=NullPool)
+    event.listen(engine, 'connect', _tune_shadow_connection)
+    try:
+        with engine.connect() as conn, conn.begin() as transaction:
+            if rebuild:
+                db.metadata.create_all(conn)
+                fts.create_index(conn)
+                set_meta(conn, 'schema_version', SCHEMA_VERSION)
+                # Keep counting from the old version, caches keyed on it must not mistake new data for old
+                set_meta(conn, 'data_version', live_meta.get('data_version', '0'))
+            yield conn
+            with metrics.stage('validate'):
+                validate_database(conn)
+            with metrics.stage('commit'):
+                transaction.commit()
+    except BaseException:
+        engine.dispose()
+        os.remove(SHADOW_PATH)
+        raise
+    engine.dispose()
+
+    with metrics.stage('swap'):
+        fd = os.open(SHADOW_PATH, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        swap_in(SHADOW_PATH)
+
+def swap_in(path: str, db_path: str = DB_PATH):
+    """Renames `path` over the live database. On Windows that fails while another process is in the
+    middle of a query (readers don't keep the file open otherwise, see read_db), so it's retried"""
+    read_db.release_connections() # Idle connections of this process would keep the old file open
+    deadline = time.monotonic() + SWAP_TIMEOUT
+    while True:
+        try:
+            os.replace(path, db_path)
+            return
+        except PermissionError as e:
+            if os.name != 'nt' or time.monotonic() >= deadline:
+                raise Exception(f"Couldn't replace {db_path}, another process keeps it open") from e
+            time.sleep(0.1)
+
+def validate_database(conn):
+    """Sanity checks the shadow database before it goes live, raises if it's unusable"""
+    result = conn.execute(text("PRAGMA quick_check")).scalar()
+    if result != 'ok':
+        raise Exception(f"The rebuilt database failed the integrity check: {result}")
+    if get_meta(conn, 'schema_version') != SCHEMA_VERSION:
+        raise Exception("The rebuilt database has the wrong schema version")
+    if get_meta(conn, 'last_commit') and conn.execute(select(func.count()).select_from(Advisory.__table__)).scalar() == 0:
+        raise Exception("The rebuilt database has no advisories, keeping the current one")
+
+def load_cwe_data(conn) -> bool:
+    """Loads the CWE catalogue, skipping it entirely if the file didn't change since the last load.
+    Returns whether it was reloaded, the advisories' CWE links then have to be rebuilt (see update_db)"""
     if not cwe_list_exists():
         print("CWE file not found...", file=sys.stderr)
         return False
 
-    Cwe.query.delete()
-
-    root = ET.parse(CWE_PATH).getroot()
-    for row in root[0]:
-        cwe = Cwe(
-            cwe_id=row.attrib['ID'],
-            name=row.attrib['Name'],
-            description=row[0].text,
-        )
-        db.session.merge(cwe)
-
-    db.session.commit()
-
-    return True
-
-def init_repo() -> bool:
-    """This clones the github repo in the project"""
-    if repo_exists():
-        return True
-
-    try:
-        print("Cloning Advisory Database...")
-        subprocess.run(['git', 'clone', REPO_URL, REPO_PATH, '--depth=1', '-b', 'main', '--single-branch'],
-                       check=True)
-    except subprocess.CalledProcessError as e:
-        raise Exception("Failed to clone the advisory repository") from e
-
-    return True
-
-
-def update_repo() -> bool:
-    """This updates the advisory repo"""
-    if not repo_exists():
-        return init_repo()
-
-    print("Updating Advisory Database...")
+    cwe_hash = utils.file_sha256(CWE_PATH)
+    if get_meta(conn, 'cwe_hash') == cwe_hash:
+        return False
 
-    old_path = os.getcwd()
-    os.chdir(REPO_PATH)
-    try:
-        output = subprocess.check_output(['git', 'pull'])
-        print(output.decode('utf-8'))
-    except subprocess.CalledProcessError as e:
-        os.chdir(old_path) # Return to the original directory
-        raise Exception("Failed to pull the latest changes in the advisory-database") from e
+    print("Loading CWE list...")
+    with metrics.stage('cwe_load'):
+        conn.execute(Cwe.__table__.delete())
+        for rows in utils.chunks(iter_cwe_rows(CWE_PATH), 1000):
+            conn.execute(insert(Cwe.__table__), rows)
+            metrics.count_rows('cwe', len(rows))
+    metrics.count('cwe_bytes_read', os.path.getsize(CWE_PATH))
 
-    os.chdir(old_path) # Return to the original directory
+    set_meta(conn, 'cwe_hash', cwe_hash)
+    bump_data_version(conn)
 
-    # If output contains "Already up to date.", we don't need to update the local db
-    if b'Already up to date.' in output:
-        print("Local database is already up to date.")
-        return False
     return True
 
-def load_repo_data() -> bool:
+def iter_cwe_rows(path: str):
+    """Streams the weaknesses out of the CWE xml without building the whole tree: every entry of the
+    catalogue's sections (weaknesses, categories, views, references) is dropped as soon as it's parsed"""
+    seen = set()
+    open_elements = [] # The root, its section, the entry... down to the element being parsed
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            open_elements.append(elem)
+            continue
+        open_elements.pop()
+        if len(open_elements) != 2: # Only whole entries of a section (a Weakness, Category, View, ...)
+            continue
+
+        # Tags are namespaced, e.g. {http://cwe.mitre.org/cwe-7}Weakness
+        if elem.tag.rpartition('}')[2] == 'Weakness':
+            cwe_id = int(elem.attrib['ID'])
+            if cwe_id not in seen:
+                seen.add(cwe_id)
+                yield {
+                    'cwe_id': cwe_id,
+                    'name': elem.attrib['Name'],
+                    'description': elem[0].text,
+                }
+        open_elements[-1].remove(elem) # Detached with its subtree, nothing keeps the entry alive
+
+def get_meta(conn, key: str, default=None):
+    value = conn.execute(select(Meta.value).where(Meta.key == key)).scalar()
+    return value if value is not None else default
+
+def set_meta(conn, key: str, value):
+    conn.execute(text("INSERT INTO meta (key, value) VALUES (:key, :value) "
+                      "ON CONFLICT (key) DO UPDATE SET value = excluded.value"), {"key": key, "value": value})
+
+def bump_data_version(conn):
+    """Marks the data as changed, so readers caching on the version (e.g. prefix_index) reload it"""
+    set_meta(conn, 'data_version', str(int(get_meta(conn, 'data_version', '0')) + 1))
+    set_meta(conn, 'data_updated_at', datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+def load_repo_data(conn, full: bool = False, progress=None) -> bool:
+    """Loads the advisories into the database `conn` is connected to (see shadow_database).
+    Only the files changed since the last ingested commit are reloaded, unless `full` is set
+    or there is no usable previous commit to diff against"""
     if not os.path.exists(REPO_PATH):
         if not update_repo():
             return False
 
-    print("Updating local database...")
-
-    json_files = glob.glob(REPO_PATH + '/advisories/github-reviewed/**/*.json', recursive=True)
-    data = []
-    for json_file in json_files:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-            data.append(json_data)
-
-    db.session.execute(text('DELETE FROM advisory_cwe'))
-    Advisory.query.delete()
-    Package.query.delete()
+    head = get_repo_head()
+    last_commit = get_meta(conn, 'last_commit')
+    if not full and last_commit == head:
+        print("Local database is already up to date.")
+        return True
 
+    with metrics.stage('diff'):
+        changes = get_changed_files(last_commit, head) if last_commit and not full else None
+
+    if changes is None:
+        print("Updating local database (full reload)...")
+        metrics.count('full_reload')
+        json_files = glob.iglob(os.path.join(REPO_PATH, ADVISORY_DIR, '**', '*.json'), recursive=True)
+
+        with metrics.stage('delete'):
+            conn.execute(advisory_cwe.delete())
+            fts.clear_index(conn)
+            rollups.clear(conn)
+            conn.execute(AffectedRange.__table__.delete())
+            conn.execute(Package.__table__.delete())
+            conn.execute(AdvisoryDetails.__table__.delete())
+            conn.execute(Advisory.__table__.delete())
+    else:
+        changed, deleted = changes
+        print(f"Updating local database ({len(changed)} changed, {len(deleted)} deleted advisories)...")
+        metrics.count('changed_files', len(changed))
+        metrics.count('deleted_files', len(deleted))
+        json_files = [os.path.join(REPO_PATH, path) for path in changed]
+
+        # The file name is the advisory id, so deletes don't need the (gone) file contents
+        stale_ids = [os.path.splitext(os.path.basename(path))[0] for path in changed | deleted]
+        with metrics.stage('delete'):
+            delete_advisories(conn, stale_ids)
+            delete_orphan_packages(conn)
+
+    # One query for the whole run instead of a lookup per cwe per advisory
+    known_cwes = set(conn.scalars(select(Cwe.cwe_id)))
+    package_ids = {(eco, name): id for id, eco, name in
+                   conn.execute(select(Package.id, Package.package_ecosystem, Package.package_name))}
     not_found_cwes = set()
 
-    for value in data:
-        advisory = Advisory(
-            advisory_id=value['id'],
-            severity=value['database_specific']['severity'],
-            summary=value['summary'],
-            details=value['details'],
-            cve_id=get_path(value, ['aliases', 0]), # Get the first alias as cve_id
-            published=str_to_date(value['published']),
-            modified=str_to_date(value['modified']),
-            withdrawn=str_to_date(value.get('withdrawn')), # Get withdrawn date if exists
-        )
-
-        for cwe in value['database_specific']['cwe_ids']:
-            val: Cwe | None = Cwe.query.get(cwe[4:]) # Get the cwe_id without the "CWE-" prefix
-            if val is not None:
-                advisory.cwes.append(val)
-            else:
-                not_found_cwes.add(int(cwe[4:]))
-
-        for package in value['affected']:
-            package_name = package['package']['name']
-            package_ecosystem = package['package']['ecosystem']
-            introduced_version = get_path(package, ['ranges', 0, 'events', 0, 'introduced'])
-            fixed_version = get_path(package, ['ranges', 0, 'events', 1, 'fixed'])
-
-            advisory.packages.append(Package(
-                advisory_id=value['id'],
-                package_name=package_name,
-                package_ecosystem=package_ecosystem,
-                introduced_version=introduced_version,
-                fixed_version=fixed_version,
-            ))
-
-        # Don't ask me why this is needed but it is trust me.
-        # I spent a good 2 hours figuring this out but this is the only thing that worked
-        temp = utils.remove_duplicates(advisory.packages)
-        advisory.packages = []
-        advisory.packages = temp
-
-        if not_found_cwes:
-            print(f"Warning: The following CWEs were not found in the database: {sorted(not_found_cwes)}")
-
-        db.session.add(advisory)
-
-    db.session.commit()
+    written = 0
+    parse_stats = new_stats()
+    loop_started, writing = time.perf_counter(), 0.0
+    for batch in iter_advisory_batches(json_files, stats=parse_stats):
+        write_started = time.perf_counter()
+        write_advisories(conn, batch, known_cwes, package_ids, not_found_cwes)
+        writing += time.perf_counter() - write_started
+        written += len(batch)
+        if progress is not None:
+            progress('advisories', written)
+
+    # Time the writer waited on the parser processes, and what they spent (summed over the processes)
+    metrics.add_seconds('parse_wait', time.perf_counter() - loop_started - writing)
+    metrics.add_seconds('read_files', parse_stats['read_seconds'])
+    metrics.add_seconds('parse_json', parse_stats['parse_seconds'])
+    metrics.count('files_read', parse_stats['files'])
+    metrics.count('bytes_read', parse_stats['bytes'])
+    metrics.count('unknown_cwes', len(not_found_cwes))
+
+    if not_found_cwes:
+        print(f"Warning: The following CWEs were not found in the database: {sorted(not_found_cwes)}")
+
+    set_meta(conn, 'last_commit', head)
+    bump_data_version(conn)
     print("Local database updated successfully.")
     return True
 
+def delete_advisories(conn, advisory_ids: list[str]):
+    """Deletes the given advisories along with their details, affected ranges and cwe links"""
+    rollups.subtract_advisories(conn, advisory_ids)
+    for ids in utils.chunks(advisory_ids, 500):
+        conn.execute(advisory_cwe.delete().where(advisory_cwe.c.advisory_id.in_(ids)))
+        fts.unindex_advisories(conn, ids)
+        conn.execute(AffectedRange.__table__.delete().where(AffectedRange.advisory_id.in_(ids)))
+        conn.execute(AdvisoryDetails.__table__.delete().where(AdvisoryDetails.advisory_id.in_(ids)))
+        conn.execute(Advisory.__table__.delete().where(Advisory.advisory_id.in_(ids)))
+
+def delete_orphan_packages(conn):
+    """Deletes packages no advisory refers to anymore"""
+    conn.execute(
+        Package.__table__.delete().where(Package.id.not_in(select(AffectedRange.package_id))))
+
+def write_advisories(conn, batch: list[dict], known_cwes: set[int], package_ids: dict[tuple, int], not_found_cwes: set[int]):
+    """Bulk inserts a batch of advisory_parser records (one executemany per table, no ORM objects).
+    `package_ids` maps (ecosystem, name) to the package id and is extended with the packages created here"""
+
+    new_packages = {}
+    for record in batch:
+        for package in record['packages']:
+            key = (package['package_ecosystem'], package['package_name'])
+            if key not in package_ids:
+                new_packages[key] = {'package_ecosystem': key[0], 'package_name': key[1],
+                                     'name_key': versions.normalize_package_name(*key)}
+    if new_packages:
+        with metrics.stage('write'):
+            result = conn.execute(
+                insert(Package.__table__).returning(Package.id, Package.package_ecosystem, Package.package_name),
+                list(new_packages.values()))
+            package_ids.update({(eco, name): id for id, eco, name in result})
+        metrics.count_rows('package', len(new_packages))
+
+    advisories, details, ranges, links = [], {}, [], []
+    for record in batch:
+        advisory_id = record['advisory']['advisory_id']
+        advisories.append(record['advisory'])
+        details[advisory_id] = record['details']
+        for package in record['packages']:
+            ranges.append({
+                'advisory_id': advisory_id,
+                'package_id': package_ids[(package['package_ecosystem'], package['package_name'])],
+                'range_type': package['range_type'],
+                'introduced_version': package['introduced_version'],
+                'fixed_version': package['fixed_version'],
+                'last_affected_version': package['last_affected_version'],
+            })
+
+        for cwe_id in dict.fromkeys(record['cwe_ids']): # Some advisories list the same cwe twice
+            if cwe_id in known_cwes:
+                links.append({'advisory_id': advisory_id, 'cwe_id': cwe_id})
+            else:
+                not_found_cwes.add(cwe_id)
+
+    with metrics.stage('compress'):
+        compressed = [{'advisory_id': advisory_id, 'details': utils.compress_text(value)}
+                      for advisory_id, value in details.items()]
+
+    with metrics.stage('write'):
+        conn.execute(insert(Advisory.__table__), advisories)
+        result = conn.execute(insert(AdvisoryDetails.__table__).returning(AdvisoryDetails.id, AdvisoryDetails.advisory_id),
+                              compressed)
+        document_ids = dict(result.fetchall()) # id -> advisory_id
+        if ranges:
+            conn.execute(insert(AffectedRange.__table__), ranges)
+        if links:
+            conn.execute(insert(advisory_cwe), links)
+    with metrics.stage('fts_index'):
+        summaries = {advisory['advisory_id']: advisory['summary'] for advisory in advisories}
+        fts.index_advisories(conn, [{'rowid': rowid, 'summary': summaries[advisory_id], 'details': details[advisory_id]}
+                                    for rowid, advisory_id in document_ids.items()])
+    with metrics.stage('rollups'):
+        rollups.add_advisories(conn, [advisory['advisory_id'] for advisory in advisories])
+    metrics.count_rows('advisory', len(advisories))
+    metrics.count_rows('advisory_details', len(compressed))
+    metrics.count_rows('affected_range', len(ranges))
+    metrics.count_rows('advisory_cwe', len(links))
 
-     
-
-def repo_exists() -> bool:
-    return os.path.exists(REPO_PATH)
 
 def cwe_list_exists() -> bool:
     return os.path.exists(CWE_PATH)
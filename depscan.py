@@ -0,0 +1,236 @@
+import json
+import os
+import re
+from bisect import bisect_right
+from urllib.parse import unquote
+
+from sqlalchemy import text, bindparam
+
+import utils
+import versions
+
+# Matches a dependency list (requirements.txt, package-lock.json or a CycloneDX JSON SBOM) against
+# the affected ranges in one pass: the ranges of every listed package are loaded with a few IN queries
+# per ecosystem, then each dependency is looked up in an in-memory interval index.
+
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(===?)\s*([^\s;,]+)')
+REQUIREMENT_NAME_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+# purl types (https://github.com/package-url/purl-spec) to advisory ecosystems
+PURL_ECOSYSTEMS = {
+    'pypi': 'PyPI',
+    'npm': 'npm',
+    'maven': 'Maven',
+    'golang': 'Go',
+    'nuget': 'NuGet',
+    'gem': 'RubyGems',
+    'cargo': 'crates.io',
+    'composer': 'Packagist',
+    'pub': 'Pub',
+    'hex': 'Hex',
+    'swift': 'SwiftURL',
+}
+
+MIN_KEY = (-1,) # Sorts before every version key, for intervals introduced at "0"
+
+RANGES_QUERY = text("""
+    SELECT package.name_key, affected_range.range_type, affected_range.introduced_version,
+           affected_range.fixed_version, affected_range.last_affected_version,
+           advisory.advisory_id, advisory.cve_id, advisory.severity, advisory.summary
+    FROM package
+    JOIN affected_range ON affected_range.package_id = package.id
+    JOIN advisory ON advisory.advisory_id = affected_range.advisory_id
+    WHERE package.package_ecosystem = :ecosystem AND package.name_key IN :names AND advisory.withdrawn IS NULL
+""").bindparams(bindparam('names', expanding=True))
+
+
+def parse_requirements(content: str) -> list[dict]:
+    """Reads pinned requirements (name==version), unpinned ones are returned without a version"""
+    dependencies = []
+    for line in content.replace('\\\n', ' ').splitlines():
+        line = line.split(' #', 1)[0].strip()
+        if not line or line.startswith(('#', '-')):
+            continue # Comments and pip options (-r, -e, --hash, --index-url, ...)
+        match = REQUIREMENT_PATTERN.match(line)
+        if match and '*' not in match.group(3):
+            dependencies.append({'ecosystem': 'PyPI', 'name': match.group(1), 'version': match.group(3)})
+        elif match := REQUIREMENT_NAME_PATTERN.match(line):
+            dependencies.append({'ecosystem': 'PyPI', 'name': match.group(1), 'version': None})
+    return dependencies
+
+def parse_package_lock(content: str) -> list[dict]:
+    """Reads every installed package of an npm lockfile (v2/v3 "packages", or v1 nested "dependencies")"""
+    lock = json.loads(content)
+    dependencies = []
+    if 'packages' in lock:
+        for path, package in lock['packages'].items():
+            if not path or package.get('link'):
+                continue # The root project and workspace links
+            name = package.get('name') or path.rsplit('node_modules/', 1)[-1]
+            dependencies.append({'ecosystem': 'npm', 'name': name, 'version': package.get('version')})
+        return dependencies
+
+    pending = list(lock.get('dependencies', {}).items())
+    while pending:
+        name, package = pending.pop()
+        dependencies.append({'ecosystem': 'npm', 'name': name, 'version': package.get('version')})
+        pending.extend(package.get('dependencies', {}).items())
+    return dependencies
+
+def parse_cyclonedx(content: str) -> list[dict]:
+    """Reads the components (nested ones included) of a CycloneDX JSON SBOM, identified by their purl"""
+    bom = json.loads(content)
+    dependencies = []
+    pending = list(bom.get('components', []))
+    while pending:
+        component = pending.pop()
+        pending.extend(component.get('components', []))
+        dependency = parse_purl(component.get('purl') or '')
+        if dependency is None:
+            dependencies.append({'ecosystem': None, 'name': component.get('name'),
+                                 'version': component.get('version')})
+        else:
+            dependency['version'] = dependency['version'] or component.get('version')
+            dependencies.append(dependency)
+    return dependencies
+
+def parse_purl(purl: str) -> dict | None:
+    """pkg:type/namespace/name@version?qualifiers#subpath -> {'ecosystem', 'name', 'version'},
+    None if it isn't a purl or its type has no advisories"""
+    if not purl.startswith('pkg:'):
+        return None
+    path = purl[4:].split('#', 1)[0].split('?', 1)[0]
+    path, _, version = path.partition('@')
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    ecosystem = PURL_ECOSYSTEMS.get(parts[0].lower())
+    if ecosystem is None or len(parts) < 2:
+        return None
+    name = (':' if ecosystem == 'Maven' else '/').join(parts[1:])
+    return {'ecosystem': ecosystem, 'name': name, 'version': unquote(version) or None}
+
+PARSERS = {
+    'requirements': parse_requirements,
+    'package-lock': parse_package_lock,
+    'cyclonedx': parse_cyclonedx,
+}
+
+def detect_format(content: str, filename: str | None = None) -> str:
+    """Guesses the format from the file name, or from the content when there is none"""
+    basename = os.path.basename(filename or '').lower()
+    if basename in ('package-lock.json', 'npm-shrinkwrap.json'):
+        return 'package-lock'
+    if basename.endswith('.txt') or basename.endswith('.in'):
+        return 'requirements'
+    if basename.endswith('.cdx.json') or basename.startswith('bom'):
+        return 'cyclonedx'
+
+    stripped = content.lstrip()
+    if not stripped.startswith('{'):
+        return 'requirements'
+    document = json.loads(stripped)
+    if document.get('bomFormat') == 'CycloneDX':
+        return 'cyclonedx'
+    if 'lockfileVersion' in document:
+        return 'package-lock'
+    raise ValueError("Unknown dependency file format, pass one of: " + ", ".join(PARSERS))
+
+def parse_dependencies(content: str, filename: str | None = None, file_format: str | None = None) -> list[dict]:
+    file_format = file_format or detect_format(content, filename)
+    if file_format not in PARSERS:
+        raise ValueError(f"Unknown format '{file_format}', expected one of: " + ", ".join(PARSERS))
+    try:
+        return PARSERS[file_format](content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid {file_format} file: {e}")
+
+
+class IntervalIndex:
+    """Affected intervals of one package, sorted by introduced version. A lookup bisects past the
+    intervals introduced after the version and only checks the upper bounds of the ones before it"""
+
+    def __init__(self, ecosystem: str):
+        self.ecosystem = ecosystem
+        self._intervals = []
+
+    def add(self, introduced: str | None, fixed: str | None, last_affected: str | None, advisory):
+        if introduced in (None, '0'):
+            start = MIN_KEY
+        else:
+            start = versions.version_key(self.ecosystem, introduced)
+        if fixed:
+            end, inclusive = versions.version_key(self.ecosystem, fixed), False
+        elif last_affected:
+            end, inclusive = versions.version_key(self.ecosystem, last_affected), True
+        else:
+            end, inclusive = None, False # Still affected
+        self._intervals.append((start, end, inclusive, fixed, advisory))
+
+    def freeze(self):
+        self._intervals.sort(key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self._intervals]
+
+    def lookup(self, version: str) -> list[tuple]:
+        """Returns (fixed_version, advisory) for the intervals containing `version`"""
+        key = versions.version_key(self.ecosystem, version)
+        matches = []
+        for start, end, inclusive, fixed, advisory in self._intervals[:bisect_right(self._starts, key)]:
+            if end is None or key < end or (inclusive and key == end):
+                matches.append((fixed, advisory))
+        return matches
+
+
+def load_indexes(conn, packages: set[tuple[str, str]]) -> dict[tuple[str, str], IntervalIndex]:
+    """Builds the interval index of every (ecosystem, name_key) in `packages` that has advisories"""
+    names_by_ecosystem = {}
+    for ecosystem, name_key in packages:
+        names_by_ecosystem.setdefault(ecosystem, []).append(name_key)
+
+    indexes = {}
+    for ecosystem, names in names_by_ecosystem.items():
+        for chunk in utils.chunks(sorted(names), 500):
+            for row in conn.execute(RANGES_QUERY, {"ecosystem": ecosystem, "names": chunk}):
+                if row.range_type == 'GIT':
+                    continue # Commit hashes, not comparable with released versions
+                if row.introduced_version is None and row.fixed_version is None and row.last_affected_version is None:
+                    continue # No range to match against
+                index = indexes.get((ecosystem, row.name_key))
+                if index is None:
+                    index = indexes[(ecosystem, row.name_key)] = IntervalIndex(ecosystem)
+                advisory = {"advisory_id": row.advisory_id, "cve_id": row.cve_id,
+                            "severity": row.severity, "summary": row.summary}
+                index.add(row.introduced_version, row.fixed_version, row.last_affected_version, advisory)
+
+    for index in indexes.values():
+        index.freeze()
+    return indexes
+
+def scan(conn, dependencies: list[dict]) -> dict:
+    """Matches dependencies ({'ecosystem', 'name', 'version'}) against the affected ranges.
+    Returns {'dependencies': count, 'vulnerable': [...], 'skipped': [...]}, vulnerable entries list
+    the advisories affecting that version with the version that fixes each (if any)"""
+    skipped = []
+    unique = {}
+    for dependency in dependencies:
+        if not dependency['ecosystem'] or not dependency['name']:
+            skipped.append({**dependency, "reason": "unknown ecosystem"})
+        elif not dependency['version']:
+            skipped.append({**dependency, "reason": "no pinned version"})
+        else:
+            name_key = versions.normalize_package_name(dependency['ecosystem'], dependency['name'])
+            unique.setdefault((dependency['ecosystem'], name_key, dependency['version']), dependency)
+
+    indexes = load_indexes(conn, {(ecosystem, name_key) for ecosystem, name_key, _ in unique})
+
+    vulnerable = []
+    for (ecosystem, name_key, version), dependency in unique.items():
+        index = indexes.get((ecosystem, name_key))
+        if index is None:
+            continue
+        advisories = {}
+        for fixed, advisory in index.lookup(version):
+            advisories.setdefault(advisory["advisory_id"], {**advisory, "fixed_version": fixed})
+        if advisories:
+            vulnerable.append({**dependency, "advisories": sorted(advisories.values(), key=lambda a: a["advisory_id"])})
+
+    vulnerable.sort(key=lambda entry: (entry['ecosystem'], entry['name'].lower(), entry['version']))
+    return {"dependencies": len(unique), "vulnerable": vulnerable, "skipped": skipped}
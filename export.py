@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select, func, and_
+
+import read_db
+import utils
+from models import Advisory, AdvisoryDetails, Cwe, Package, AffectedRange, advisory_cwe
+
+# Streams the dataset out as NDJSON or CSV for downstream jobs. Rows are read from a server-side
+# cursor and written out as they come, so an export of the whole database runs in constant memory.
+# `modified_since` limits advisories (and their affected ranges) to those changed since a time, for
+# consumers pulling deltas; deleted advisories don't show up in a delta, withdrawn ones do.
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+FETCH_SIZE = 1000 # rows buffered from the cursor at a time
+CSV_FLUSH_ROWS = 500
+
+
+def advisory_filters(filters: dict) -> list:
+    conditions = []
+    if filters.get('modified_since'):
+        conditions.append(Advisory.modified >= filters['modified_since'])
+    if filters.get('severity'):
+        conditions.append(Advisory.severity == filters['severity'].upper())
+    if filters.get('ecosystem'):
+        conditions.append(Advisory.affected.any(AffectedRange.package.has(Package.package_ecosystem == filters['ecosystem'])))
+    if not filters.get('include_withdrawn', True):
+        conditions.append(Advisory.withdrawn.is_(None))
+    return conditions
+
+def advisories_query(filters: dict):
+    cwe_ids = select(func.group_concat(advisory_cwe.c.cwe_id)) \
+        .where(advisory_cwe.c.advisory_id == Advisory.advisory_id).scalar_subquery()
+    return select(
+        Advisory.advisory_id, Advisory.cve_id, Advisory.severity, Advisory.summary, AdvisoryDetails.details,
+        Advisory.published, Advisory.modified, Advisory.withdrawn, cwe_ids.label('cwe_ids'),
+    ).outerjoin(AdvisoryDetails, AdvisoryDetails.advisory_id == Advisory.advisory_id) \
+     .where(*advisory_filters(filters)).order_by(Advisory.advisory_id)
+
+def affected_query(filters: dict):
+    query = select(
+        AffectedRange.advisory_id, Package.package_ecosystem.label('ecosystem'), Package.package_name,
+        AffectedRange.range_type, AffectedRange.introduced_version, AffectedRange.fixed_version,
+        AffectedRange.last_affected_version,
+    ).join(Package, Package.id == AffectedRange.package_id)
+    conditions = advisory_filters({**filters, 'ecosystem': None}) # The ecosystem is matched on the range's own package
+    if conditions:
+        query = query.join(Advisory, Advisory.advisory_id == AffectedRange.advisory_id).where(and_(*conditions))
+    if filters.get('ecosystem'):
+        query = query.where(Package.package_ecosystem == filters['ecosystem'])
+    return query.order_by(AffectedRange.advisory_id)
+
+def cwes_query(filters: dict):
+    return select(Cwe.cwe_id, Cwe.name, Cwe.description).order_by(Cwe.cwe_id)
+
+# dataset -> (query builder, columns holding lists, compressed columns)
+DATASETS = {
+    'advisories': (advisories_query, {'cwe_ids'}, {'details'}),
+    'affected': (affected_query, set(), set()),
+    'cwes': (cwes_query, set(), set()),
+}
+
+
+def parse_filters(args) -> dict:
+    """Reads the export filters from a mapping of strings (query string or CLI options), raises ValueError"""
+    filters = {
+        'severity': args.get('severity') or None,
+        'ecosystem': args.get('ecosystem') or None,
+        'include_withdrawn': str(args.get('include_withdrawn', 'true')).lower() not in ('0', 'false', 'no'),
+        'modified_since': None,
+    }
+    if args.get('modified_since'):
+        value = args['modified_since'].strip().rstrip('Z')
+        try:
+            filters['modified_since'] = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid modified_since '{args['modified_since']}', expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SSZ")
+    return filters
+
+def iter_rows(dataset: str, filters: dict):
+    """Yields the dataset's rows as dicts, straight off the cursor"""
+    build_query, list_columns, compressed_columns = DATASETS[dataset]
+    with read_db.get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=FETCH_SIZE) \
+                     .execute(build_query(filters))
+        for row in result.mappings():
+            row = dict(row)
+            for name in list_columns:
+                row[name] = [int(value) for value in row[name].split(',')] if row[name] else []
+            for name in compressed_columns:
+                row[name] = utils.decompress_text(row[name])
+            yield row
+
+def columns(dataset: str) -> list[str]:
+    build_query = DATASETS[dataset][0]
+    return [column.name for column in build_query({}).selected_columns]
+
+def to_json_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return value
+
+def stream(dataset: str, file_format: str, filters: dict):
+    """Yields the export as text chunks in `file_format` (ndjson or csv)"""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset '{dataset}', expected one of: " + ", ".join(DATASETS))
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format '{file_format}', expected one of: " + ", ".join(FORMATS))
+    return (stream_ndjson if file_format == 'ndjson' else stream_csv)(dataset, filters)
+
+def stream_ndjson(dataset: str, filters: dict):
+    for row in iter_rows(dataset, filters):
+        yield json.dumps({name: to_json_value(value) for name, value in row.items()}) + '\n'
+
+def stream_csv(dataset: str, filters: dict):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns(dataset))
+    for i, row in enumerate(iter_rows(dataset, filters), 1):
+        writer.writerow([';'.join(map(str, value)) if isinstance(value, list) else to_json_value(value)
+                         for value in row.values()])
+        if i % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,106 @@
+import unicodedata
+from collections import namedtuple
+
+from sqlalchemy import text, bindparam
+
+import utils
+
+# Full-text index over advisory summaries and details (SQLite FTS5).
+# database.load_repo_data keeps it in sync with the advisory table.
+# The index is contentless, it holds the tokens but not a second copy of the text: a document's rowid
+# is its advisory_details.id, and snippets are cut from the stored details of the few rows returned.
+
+FTS_TABLE = 'advisory_fts'
+SNIPPET_WORDS = 16
+
+SearchResult = namedtuple('SearchResult', ['advisory_id', 'cve_id', 'severity', 'summary', 'published', 'modified',
+                                           'withdrawn', 'snippet'])
+
+
+def create_index(conn):
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        "USING fts5(summary, details, content='', tokenize='unicode61 remove_diacritics 2')"
+    ))
+
+def drop_index(conn):
+    conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+def clear_index(conn):
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')"))
+
+def index_advisories(conn, documents: list[dict]):
+    """Adds documents (dicts with rowid, the advisory_details.id, summary and details) to the index"""
+    conn.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, summary, details) VALUES (:rowid, :summary, :details)"),
+        documents)
+
+def unindex_advisories(conn, advisory_ids: list[str]):
+    """Removes the advisories from the index, call it before their rows are deleted: a contentless
+    index can only drop a document when it's given the text that was indexed"""
+    sql = text(
+        "SELECT advisory_details.id, advisory.summary, advisory_details.details FROM advisory_details "
+        "JOIN advisory ON advisory.advisory_id = advisory_details.advisory_id "
+        "WHERE advisory_details.advisory_id IN :ids"
+    ).bindparams(bindparam('ids', expanding=True))
+    delete = text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, summary, details) "
+                  "VALUES ('delete', :rowid, :summary, :details)")
+    for ids in utils.chunks(advisory_ids, 500):
+        documents = [{"rowid": rowid, "summary": summary, "details": utils.decompress_text(details)}
+                     for rowid, summary, details in conn.execute(sql, {"ids": ids})]
+        if documents:
+            conn.execute(delete, documents)
+
+def to_match_query(search_value: str) -> str | None:
+    """Turns free text into an FTS5 query: every word must match, the last one as a prefix (for typing).
+    Words are quoted so characters like '-' or '"' can't break the query syntax"""
+    words = str(search_value).split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return " ".join(terms)
+
+def search_advisories(conn, search_value: str, limit: int = 10, snippets: bool = True) -> list[SearchResult]:
+    """Ranked full-text search. Returns the matching advisories with a snippet of their details
+    (None unless `snippets`, which decompresses the details of every row returned), best match first.
+    Matches in the summary weigh more than matches in the details"""
+    match = to_match_query(search_value)
+    if match is None:
+        return []
+
+    sql = text(
+        "SELECT advisory.advisory_id, advisory.cve_id, advisory.severity, advisory.summary, advisory.published, "
+        f"advisory.modified, advisory.withdrawn, {'advisory_details.details' if snippets else 'NULL'} AS details "
+        f"FROM {FTS_TABLE} JOIN advisory_details ON advisory_details.id = {FTS_TABLE}.rowid "
+        "JOIN advisory ON advisory.advisory_id = advisory_details.advisory_id "
+        f"WHERE {FTS_TABLE} MATCH :match "
+        f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0) "
+        "LIMIT :limit"
+    )
+    words = str(search_value).split()
+    return [
+        SearchResult(*row[:-1], make_snippet(utils.decompress_text(row.details), words) if snippets else None)
+        for row in conn.execute(sql, {"match": match, "limit": limit})
+    ]
+
+def fold(word: str) -> str:
+    """Lowercases and strips accents and punctuation, roughly what the unicode61 tokenizer does"""
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(char for char in word if char.isalnum())
+
+def make_snippet(details: str, words: list[str]) -> str:
+    """About SNIPPET_WORDS words of the details around the first match of the search words
+    (the last one matching as a prefix), like FTS5's snippet()"""
+    tokens = details.split()
+    terms = [fold(word) for word in words]
+    first_match = 0
+    for i, token in enumerate(tokens):
+        token = fold(token)
+        if token in terms[:-1] or (terms and terms[-1] and token.startswith(terms[-1])):
+            first_match = i
+            break
+
+    start = max(0, min(first_match - SNIPPET_WORDS // 4, len(tokens) - SNIPPET_WORDS))
+    end = start + SNIPPET_WORDS
+    return ('...' if start > 0 else '') + ' '.join(tokens[start:end]) + ('...' if end < len(tokens) else '')
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import time
+STARTED_AT = time.perf_counter() # Taken before the other imports, for the time-to-first-response report
+
 import dash
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
 from gui_project_grid import set_layout
 from datetime import datetime
+import utils
 
 # Initialize the app
-gui = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP]) # prevent_initial_callbacks = True
+# The grids' callbacks (gui_project_grid.register_callbacks) target components that only exist once
+# display_page has rendered their page, so they're not in the initial layout
+gui = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True) # prevent_initial_callbacks = True
 
 # Greeting function
 def get_greeting():
@@ -193,4 +199,5 @@ error_page = dbc.Container([
 
 # Run the app
 if __name__ == '__main__':
+    utils.report_first_response(gui.server, STARTED_AT, "gui")
     gui.run(host='localhost', port=8080, debug=False) # enable debug mode to see errors
\ No newline at end of file
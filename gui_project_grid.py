@@ -1,83 +1,193 @@
-from sqlalchemy import create_engine, MetaData, Table
-from sqlalchemy.orm import sessionmaker
-from dash import Dash, html
+from datetime import datetime, timedelta
+
+from dash import callback
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import dash_ag_grid as dag
+from sqlalchemy import select, func, and_, or_
 
-db = 'instance/advisory.db' # db address
+import read_db
 
-# fetch data from the advisory database
-def get_data_cve():
-    engine = create_engine("sqlite:///"+db)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
-    try:
-        # set table
-        metadata = MetaData()
-        cve_table = Table('advisory', metadata, autoload_with=engine)
-        
-        # get data from table
-        result = session.query(cve_table).all()
-        
-        # convert rows to a list of dictionaries
-        columns = cve_table.columns.keys()                  # get column names
-        data = [dict(zip(columns, row)) for row in result]  # map rows to columns
-        
-        return data
-    finally:
-        session.close() # ensure session is closed
-
-# fetch data from the cwe database
-def get_data_cwe():
-    engine = create_engine("sqlite:///"+db)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
+PAGE_SIZE = 50
+
+# Grid settings per model: the table behind it, its key (tie-breaker for stable paging) and the columns shown.
+# The advisory details are left out on purpose, they are multi-KB each and the grid never shows them
+GRIDS = {
+    "cve": {
+        "table": "advisory",
+        "key": "advisory_id",
+        "columns": {
+            "advisory_id": "text",
+            "cve_id": "text",
+            "severity": "text",
+            "summary": "text",
+            "published": "date",
+            "modified": "date",
+            "withdrawn": "date",
+        },
+    },
+    "cwe": {
+        "table": "cwe",
+        "key": "cwe_id",
+        "columns": {
+            "cwe_id": "number",
+            "name": "text",
+            "description": "text",
+        },
+    },
+}
+
+FILTERS = {"text": "agTextColumnFilter", "number": "agNumberColumnFilter", "date": "agDateColumnFilter"}
+
+
+# fetches one block of rows, with the grid's sorting and filtering done in SQL
+def get_rows(model, start_row, end_row, sort_model=None, filter_model=None):
+    # The block comes from the client, it gets at most one cache block (PAGE_SIZE rows) however much it asks for
+    start_row, end_row = int(start_row), int(end_row)
+    if start_row < 0 or end_row <= start_row:
+        raise ValueError(f"Invalid block {start_row}-{end_row}")
+    end_row = min(end_row, start_row + PAGE_SIZE)
+
+    grid = GRIDS[model]
+    table = read_db.get_table(grid["table"])
+    columns = [table.c[name] for name in grid["columns"]]
+
+    conditions = build_conditions(table, grid["columns"], filter_model or {})
+
+    order_by = []
+    for sort in sort_model or []:
+        if sort["colId"] in grid["columns"]:
+            column = table.c[sort["colId"]]
+            order_by.append(column.desc() if sort["sort"] == "desc" else column.asc())
+    order_by.append(table.c[grid["key"]].asc())
+
+    query = select(*columns).where(*conditions).order_by(*order_by) \
+                            .offset(start_row).limit(end_row - start_row)
+
+    with read_db.get_session() as session:
+        rows = [dict(row._mapping) for row in session.execute(query)]
+        # The total is only needed once per sort/filter, the grid remembers it for the next blocks
+        row_count = session.execute(select(func.count()).select_from(table).where(*conditions)).scalar() \
+            if start_row == 0 else None
+
+    for row in rows:
+        for name, value in row.items():
+            if isinstance(value, datetime):
+                row[name] = value.strftime('%Y-%m-%d %H:%M:%S')
+    return rows, row_count
+
+# translates an AG Grid filter model into SQL conditions, only for the columns the grid shows
+def build_conditions(table, column_types, filter_model):
+    conditions = []
+    for name, model in filter_model.items():
+        if name not in column_types:
+            continue
+        condition = build_condition(table.c[name], column_types[name], model)
+        if condition is not None:
+            conditions.append(condition)
+    return conditions
+
+def build_condition(column, column_type, model):
+    # Combined filters: {"operator": "AND", "conditions": [...]} (older grids use condition1/condition2)
+    if "operator" in model:
+        parts = model.get("conditions") or [model.get("condition1"), model.get("condition2")]
+        parts = [build_condition(column, column_type, part) for part in parts if part]
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            return None
+        return or_(*parts) if model["operator"] == "OR" else and_(*parts)
+
+    kind = model.get("type")
+    if kind == "blank":
+        return column.is_(None)
+    if kind == "notBlank":
+        return column.is_not(None)
+
+    if column_type == "text":
+        value = str(model.get("filter", ""))
+        return {
+            "contains": lambda: column.contains(value, autoescape=True),
+            "notContains": lambda: ~column.contains(value, autoescape=True),
+            "equals": lambda: column == value,
+            "notEqual": lambda: column != value,
+            "startsWith": lambda: column.startswith(value, autoescape=True),
+            "endsWith": lambda: column.endswith(value, autoescape=True),
+        }.get(kind, lambda: None)()
+
+    if column_type == "date":
+        # Dates come as "YYYY-MM-DD HH:MM:SS", compare whole days
+        value = parse_date(model.get("dateFrom"))
+        if value is None:
+            return None
+        next_day = value + timedelta(days=1)
+        if kind == "inRange":
+            to_value = parse_date(model.get("dateTo"))
+            return and_(column >= value, column < to_value + timedelta(days=1)) if to_value else None
+        return {
+            "equals": lambda: and_(column >= value, column < next_day),
+            "notEqual": lambda: or_(column < value, column >= next_day),
+            "lessThan": lambda: column < value,
+            "greaterThan": lambda: column >= next_day,
+        }.get(kind, lambda: None)()
+
+    value = model.get("filter")
+    if value is None:
+        return None
+    if kind == "inRange":
+        return column.between(value, model.get("filterTo", value))
+    return {
+        "equals": lambda: column == value,
+        "notEqual": lambda: column != value,
+        "lessThan": lambda: column < value,
+        "lessThanOrEqual": lambda: column <= value,
+        "greaterThan": lambda: column > value,
+        "greaterThanOrEqual": lambda: column >= value,
+    }.get(kind, lambda: None)()
+
+def parse_date(value):
     try:
-        # set table
-        metadata = MetaData()
-        cwe_table = Table('cwe', metadata, autoload_with=engine)
-
-        # get data from table
-        result = session.query(cwe_table).all()
-        
-        # convert rows to a list of dictionaries
-        columns = cwe_table.columns.keys()                  # get column names
-        data = [dict(zip(columns, row)) for row in result]  # map rows to columns
-        
-        return data
-    finally:
-        session.close() # ensure session is closed
-
-# gets data from advisory.db
-cve_data = get_data_cve()
-cwe_data = get_data_cwe()
+        return datetime.strptime(value[:10], '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
 
 # sets layout depending on selected model: cve, cwe
 def set_layout(model):
+    grid = GRIDS[model]
+    column_defs = [{"headerName": name, "field": name, "filter": FILTERS[column_type]}
+                   for name, column_type in grid["columns"].items()]
 
-    if model=="cve":
-        # generates column definitions based on the keys of the first row
-        column_defs = [{"headerName": key, "field": key} for key in cve_data[0].keys()]
-        row_data = cve_data
-    elif model=="cwe":
-        # generates column definitions based on the keys of the first row
-        column_defs = [{"headerName": key, "field": key} for key in cwe_data[0].keys()]
-        row_data = cwe_data
-    else:
-        column_defs = []
-    
-    # returns grid details to app.layout
+    # returns grid details to app.layout, the rows are fetched block by block through get_rows_response
     return dag.AgGrid(
-        id='vulnerability_reporter',
+        id=f'{model}_grid',
         columnDefs=column_defs,  # column def
-        rowData=row_data,        # row data
+        rowModelType="infinite",
         columnSize="autoSize",
-        defaultColDef={"resizable": True, "sortable": True, "filter": True},
-        dashGridOptions={"pagination": True, "paginationPageSize": 50},
+        defaultColDef={"resizable": True, "sortable": True, "filter": True,
+                       "filterParams": {"buttons": ["apply", "reset"]}},
+        dashGridOptions={"pagination": True, "paginationPageSize": PAGE_SIZE, "cacheBlockSize": PAGE_SIZE,
+                         "maxBlocksInCache": 10},
         style={'height': '500px', 'width': '100%'}
     )
 
+def register_callbacks(model):
+    @callback(Output(f'{model}_grid', 'getRowsResponse'), Input(f'{model}_grid', 'getRowsRequest'))
+    def get_rows_response(request):
+        if request is None:
+            raise PreventUpdate
+        try:
+            rows, row_count = get_rows(model, request["startRow"], request["endRow"],
+                                       request.get("sortModel"), request.get("filterModel"))
+        except (KeyError, TypeError, ValueError):
+            raise PreventUpdate # A malformed request, the grid never sends one
+
+        response = {"rowData": rows}
+        if row_count is not None:
+            response["rowCount"] = row_count
+        return response
+
+for grid_model in GRIDS:
+    register_callbacks(grid_model)
+
 # for styling, check out:
 # https://www.ag-grid.com/angular-data-grid/theming-colors/#color-schemes
-# depends on GUI template
\ No newline at end of file
+# depends on GUI template
@@ -1,40 +1,37 @@
-import sqlite3
-from sqlalchemy import create_engine, MetaData, Table
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text 
+import time
+STARTED_AT = time.perf_counter() # Taken before the other imports, for the time-to-first-response report
+
+import threading
+
 from dash import Dash, html, callback
 from dash import dcc
 from dash.dependencies import Input,Output, State
 from dash.exceptions import PreventUpdate
 
-db = 'instance/advisory.db' # db address
-data = []
+import advisory_detail
+import fts
+import prefix_index
+import read_db
+import utils
 
-#Query to get all matching IDs
-def get_data(search_value):
-    tempstr = str(search_value)+'%'
-    engine = create_engine("sqlite:///"+db)
-    
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    sql_statment = text("SELECT * FROM advisory where advisory_id LIKE :val Limit 10")
-    cursor = session.execute(sql_statment, {"val" : tempstr})
-    tuples = list(cursor.fetchall())
-    session.close()
-    return tuples
-    
-#Extracting the IDs from query
-def get_ID_data(tuples):
-    id_data = []
-    for i in range(len(tuples)):
-        id_data.append(str(tuples[i][0]))
-    return id_data
+#The selected advisory with its CWEs and packages (cached, see advisory_detail.py)
+def get_data(advisory_id):
+    return advisory_detail.get_advisory(advisory_id)
+
+#Query to get the advisories whose summary/details match the search text, best match first
+def get_text_data(search_value):
+    with read_db.get_session() as session:
+        return fts.search_advisories(session, search_value, limit=10, snippets=False)
 
 app = Dash(__name__)
 
 #Setting the Layout
 app.layout = html.Div([
     html.H1("Enter a CVE ID to browse to a specific project:"),
+    dcc.RadioItems(id = 'search-mode', value = 'id', inline = True, options = [
+        {'label': 'Advisory ID', 'value': 'id'},
+        {'label': 'Full text (summary and details)', 'value': 'text'},
+    ]),
     dcc.Dropdown(id = 'my-input', maxHeight=300),
     html.Br(),
     html.Div(html.Table([
@@ -46,22 +43,26 @@ app.layout = html.Div([
         html.Tr([html.Th('Details'), html.Td(id='my-output-3')]),
         html.Tr([html.Th('Published'), html.Td(id='my-output-5')]),
         html.Tr([html.Th('Modified'), html.Td(id='my-output-6')]),
-        html.Tr([html.Th('Withdrawn'), html.Td(id='my-output-7')])
+        html.Tr([html.Th('Withdrawn'), html.Td(id='my-output-7')]),
+        html.Tr([html.Th('Affected packages'), html.Td(id='my-output-9')])
     ]))
 ])
 
 #Updating the Options everytime user changes the search value
 @callback(
     Output(component_id='my-input', component_property='options'),
-    Input(component_id='my-input', component_property='search_value')
+    Input(component_id='my-input', component_property='search_value'),
+    State(component_id='search-mode', component_property='value')
 )
-def update_options(search_value):
+def update_options(search_value, mode):
     if not search_value:
         raise PreventUpdate
-    global data 
-    data = get_data(search_value)
-    id_data = get_ID_data(data)
-    return id_data
+    if mode == 'text':
+        rows = get_text_data(search_value)
+        # 'search' stops the dropdown from filtering out matches whose label doesn't contain the typed text
+        return [{'label': f"{row.advisory_id}: {row.summary}", 'value': row.advisory_id, 'search': search_value} for row in rows]
+    # Advisory, CVE and CWE ids are served from memory, no database round trip per keystroke
+    return prefix_index.search(search_value)
 
 #Outputing the value to the table
 @callback(
@@ -74,43 +75,28 @@ def update_options(search_value):
     Output(component_id='my-output-6', component_property='children'),
     Output(component_id='my-output-7', component_property='children'),
     Output(component_id='my-output-8', component_property='children'),
+    Output(component_id='my-output-9', component_property='children'),
     Input(component_id='my-input', component_property='value')
 )
 def update_output_div(input_value):
-    #Finding cwe ID from another table
-    if input_value is not None and input_value != "":
-        engine = create_engine("sqlite:///"+db)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        try:
-            # set table
-            metadata = MetaData()
-            cwe_table = Table('advisory_cwe', metadata, autoload_with=engine)
-            # get data from table
-            result = session.query(cwe_table).filter_by(advisory_id = input_value).all()
-            result_str = ""
-            for i in range(len(result)):
-                result_str += "CWE-"+str(result[i][1])
-                if i != len(result)-1:
-                    result_str+=", "
-        finally:
-            session.close() # ensure session is closed
-    
-    tuple = []
-    found = False
-    global data
-    for i in range(len(data)):
-        if str(data[i][0]) == input_value:
-            tuple = data[i]
-            found = True
-            break
-    if found:
-        return input_value, tuple[4] ,tuple[1], tuple[2], tuple[3], tuple[5], tuple[6], tuple[7], result_str
-    else:
-        return "","","","","","","","",""
+    advisory = get_data(input_value) if input_value else None
+    if advisory is None:
+        return "","","","","","","","","",""
+
+    cwes = ", ".join(f"CWE-{cwe['cwe_id']}" for cwe in advisory['cwes'])
+    packages = html.Ul([
+        html.Li(f"{package['ecosystem']} {package['name']}: "
+                + "; ".join(advisory_detail.format_range(affected_range) for affected_range in package['ranges']))
+        for package in advisory['packages']
+    ])
+    return (advisory['advisory_id'], advisory['cve_id'], advisory['severity'], advisory['summary'], advisory['details'],
+            advisory['published'], advisory['modified'], advisory['withdrawn'], cwes, packages)
 
 
 #python gui_search_bar.py
 
 if __name__ == '__main__':
+    # Build the typeahead index in the background, a search arriving before it's ready waits for it
+    threading.Thread(target=prefix_index.get_index, name='prefix-index', daemon=True).start()
+    utils.report_first_response(app.server, STARTED_AT, "search bar")
     app.run(host="localhost", port=8080, debug=True)
\ No newline at end of file
@@ -1,21 +1,19 @@
 
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text,case,func
-from database import db_exists,init_or_update_db
+import base64
+import json
+from datetime import date, datetime, timedelta
 
-import xml.etree.ElementTree as ET
+from sqlalchemy import text,select,and_,tuple_,DateTime
+import read_db
 
-db = SQLAlchemy()
-
-from models import Cwe, Advisory, Package
+from models import Cwe, Advisory, Package, AffectedRange
 
 
 def fetchAllCVEs():
     """Fetches all cve-ids (which means any entry with no cve-id will be discarded), return them as a string array"""
-    if not db_exists():
-        init_or_update_db()
     print("Fetching all CVEs")
-    cve_ids = db.session.query(Advisory.cve_id).all()
+    with read_db.get_session() as session:
+        cve_ids = session.query(Advisory.cve_id).all()
 
     cve_id_array = [cve_id[0] for cve_id in cve_ids if cve_id[0] is not None]
 
@@ -23,89 +21,148 @@ def fetchAllCVEs():
 
 def fetchAllCWEs():
     """Fetches all cwe-ids, return them as a string array"""
-    if not db_exists():
-        init_or_update_db()
     print("Fetching all CWEs")
-    cwe_ids = db.session.query(Cwe.cwe_id).all()
+    with read_db.get_session() as session:
+        cwe_ids = session.query(Cwe.cwe_id).all()
 
     cwe_id_array = [cwe_id[0] for cwe_id in cwe_ids if cwe_id[0] is not None]
 
     return cwe_id_array
 
-def filterCVEs(filters: dict):
-    """Filters CVEs based on a dictionary of filters. (e.g. {'severity': 'high', 'projectName': 'example', 'orderBy': 'published', 'order': 'desc'})"""
-    q = db.session.query(Advisory)
-    orderBy = Advisory.advisory_id
-    ascending = True
-    #assign values to severity scores for ordering
-    severity_order = case(
-        value=Advisory.severity,
-        whens={
-            'LOW': 1,
-            'MODERATE': 2,
-            'HIGH': 3,
-            'CRITICAL': 4,
-        }
+# Sort keys for filterCVEs, each ends with advisory_id so the order (and the keyset cursor) is unique
+SORT_KEYS = {
+    'advisory_id': [Advisory.advisory_id],
+    'published': [Advisory.published, Advisory.advisory_id],
+    'modified': [Advisory.modified, Advisory.advisory_id],
+    'withdrawn': [Advisory.withdrawn, Advisory.advisory_id],
+    'severity': [Advisory.severity_rank, Advisory.advisory_id],
+    'cve_id': [Advisory.cve_year, Advisory.cve_number, Advisory.advisory_id],
+}
+
+def filterCVEs(filters: dict, cursor: str | None = None, limit: int = 50) -> dict:
+    """Filters CVEs based on a dictionary of filters, one page at a time.
+    (e.g. {'severity': 'high', 'projectName': 'example', 'ecosystem': 'PyPI', 'publishedFrom': '2024-01-01',
+    'publishedTo': '2024-12-31', 'modifiedFrom': ..., 'modifiedTo': ..., 'withdrawn': False, 'orderBy': 'published', 'order': 'desc'})
+    Returns {'items': [row, ...], 'next_cursor': str | None}, pass next_cursor back to get the following page.
+    The rows hold the advisory table's columns (advisory_id, cve_id, severity, summary, published, ...),
+    not ORM objects: use advisory_detail.get_advisory for the details, CWEs and packages of one.
+    When ordering by withdrawn or cve_id, entries without one come last"""
+    q = select(*Advisory.__table__.columns)
+
+    if filters.get('severity'):
+        q = q.where(Advisory.severity == filters['severity'].upper())
+
+    if filters.get('projectName') or filters.get('ecosystem'):
+        # EXISTS instead of a join, an advisory listing several ranges of the package must come back once
+        package_filter = []
+        if filters.get('projectName'):
+            package_filter.append(Package.package_name == filters['projectName'])
+        if filters.get('ecosystem'):
+            package_filter.append(Package.package_ecosystem == filters['ecosystem'])
+        q = q.where(Advisory.affected.any(AffectedRange.package.has(and_(*package_filter))))
+
+    for column, name in ((Advisory.published, 'published'), (Advisory.modified, 'modified')):
+        if filters.get(name + 'From'):
+            q = q.where(column >= to_datetime(filters[name + 'From']))
+        if filters.get(name + 'To'):
+            q = q.where(column < to_datetime(filters[name + 'To']) + timedelta(days=1)) # The whole "to" day
+
+    if filters.get('withdrawn') is not None:
+        q = q.where(Advisory.withdrawn.is_not(None) if filters['withdrawn'] else Advisory.withdrawn.is_(None))
+
+    sort_key = SORT_KEYS.get(filters.get('orderBy', 'advisory_id'), SORT_KEYS['advisory_id'])
+    ascending = filters.get('order', 'asc') != 'desc'
+    last_values = decode_cursor(cursor, sort_key) if cursor else None
+
+    def fetch(q, key, after, count):
+        # Keyset pagination: continue right after the last row of the previous page, which the indexes
+        # on the sort keys turn into a seek instead of skipping over every earlier row
+        if after is not None:
+            q = q.where(tuple_(*key) > tuple_(*after) if ascending else tuple_(*key) < tuple_(*after))
+        q = q.order_by(*[column.asc() if ascending else column.desc() for column in key]).limit(count)
+        return session.execute(q).fetchall()
+
+    with read_db.get_session() as session:
+        if not sort_key[0].nullable:
+            items = fetch(q, sort_key, last_values, limit + 1)
+        else:
+            # Entries without a value (withdrawn, cve_id) come last in either order, by advisory_id. Two queries
+            # because a NULL can't be compared in the cursor, and an OR or a NULLS LAST would give up the index seek
+            items = []
+            if last_values is None or last_values[0] is not None:
+                items = fetch(q.where(sort_key[0].is_not(None)), sort_key, last_values, limit + 1)
+            if len(items) <= limit:
+                after = last_values[-1:] if last_values is not None and last_values[0] is None else None
+                q = q.where(*[column.is_(None) for column in sort_key[:-1]])
+                items += fetch(q, sort_key[-1:], after, limit + 1 - len(items))
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in sort_key])
+
+    return {'items': items, 'next_cursor': next_cursor}
+
+def encode_cursor(values: list) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, sort_key: list) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(values) != len(sort_key):
+            raise ValueError("cursor doesn't match the sort order")
+        return [datetime.fromisoformat(value) if value is not None and isinstance(column.type, DateTime) else value
+                for column, value in zip(sort_key, values)]
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def to_datetime(value) -> datetime:
+    """Accepts datetimes, dates and 'YYYY-MM-DD' strings"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.strptime(value, '%Y-%m-%d')
+
+PROJECT_CVES_PAGE = text("""
+    WITH page AS (
+        SELECT id, package_name, package_ecosystem FROM package
+        WHERE (package_name, package_ecosystem) > (:after_name, :after_ecosystem)
+        ORDER BY package_name, package_ecosystem
+        LIMIT :limit
     )
-    if 'severity' in filters:
-        q = q.filter(Advisory.severity == filters['severity'])
-
-    if 'projectName' in filters:
-        q = q.join(Package).filter(Package.package_name == filters['projectName'])
-
-    if 'orderBy' in filters:
-        if filters['orderBy'] == 'severity':
-            orderBy = severity_order
-        elif filters['orderBy'] == 'published':
-            orderBy = Advisory.published
-        elif filters['orderBy'] == 'modified':
-            orderBy = Advisory.modified
-        elif filters['orderBy'] == 'withdrawn':
-            orderBy = Advisory.withdrawn
-        elif filters['orderBy'] == 'advisory_id':
-            orderBy = Advisory.advisory_id
-        elif filters['orderBy'] == 'cve_id':
-            year_part = func.substring(Advisory.cve_id, 5, 4)
-            number_part = func.substring(Advisory.cve_id, 10)
-            if ascending:
-                q.order_by(func.cast(year_part, db.Integer).asc())
-                q.order_by(func.cast(number_part, db.Integer).asc())
-            else:
-                q.order_by(func.cast(year_part, db.Integer).desc())
-                q.order_by(func.cast(number_part, db.Integer).desc())
-
-    if 'order' in filters:
-        if filters['order'] == 'desc':
-            ascending = False
-        elif filters['order'] == 'asc':
-            ascending = True
-
-    if 'withdrawn' in filters:
-        print()
-        #in chronological order
-
-
-    if ascending:
-        q.order_by(orderBy.asc())
-    else:
-        q.order_by(orderBy.desc())
-
-    return q.all()
-    
-def getProjectCVEs():
-    """Group all advisory entries (so entries with no cve-id will still be considered) by project, returns a string tuple array"""
-    results = db.session.query(Package.package_name, Advisory.cve_id) \
-                        .join(Advisory, Package.advisory_id == Advisory.advisory_id) \
-                        .all()
-    #transform results into dicts for python usage
-    projectCVEs = []
-    for package_name, cve_id in results:
-        projectCVEs.append({
-            "project": package_name,
-            "cve_id": cve_id
-        })
-    #remove duplicate project entries and glue the CVEs together
-    output = []
-    for project, cves in projectCVEs.items():
-        output.append({"project": project,"cve_ids": cves})
-    return output
+    SELECT page.package_name, page.package_ecosystem, group_concat(DISTINCT advisory.cve_id) AS cve_ids
+    FROM page
+    LEFT JOIN affected_range ON affected_range.package_id = page.id
+    LEFT JOIN advisory ON advisory.advisory_id = affected_range.advisory_id
+    GROUP BY page.id
+    ORDER BY page.package_name, page.package_ecosystem
+""")
+
+def getProjectCVEs(cursor: str | None = None, limit: int = 100) -> dict:
+    """Group all advisory entries (so entries with no cve-id will still be considered) by project, one page at a time.
+    Returns {'items': [{'project', 'ecosystem', 'cve_ids'}, ...], 'next_cursor': str | None}.
+    The grouping is done by SQLite over one page of packages, so memory stays O(limit)"""
+    after = decode_cursor(cursor, [Package.package_name, Package.package_ecosystem]) if cursor else ['', '']
+    with read_db.get_session() as session:
+        rows = session.execute(PROJECT_CVES_PAGE, {"after_name": after[0], "after_ecosystem": after[1], "limit": limit}).fetchall()
+
+    items = [{
+        "project": package_name,
+        "ecosystem": ecosystem,
+        "cve_ids": cve_ids.split(',') if cve_ids else [],
+    } for package_name, ecosystem, cve_ids in rows]
+
+    next_cursor = encode_cursor([rows[-1][0], rows[-1][1]]) if len(rows) == limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+def iterProjectCVEs(page_size: int = 500):
+    """Streams every project with its cve-ids, fetching one page at a time"""
+    cursor = None
+    while True:
+        page = getProjectCVEs(cursor, page_size)
+        yield from page['items']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import read_db
+
+# Timings and counters of the ingest, one record per run. database.update_db starts and finishes
+# a run, the stages inside it add to the current one. The last run is kept in a JSON file so the
+# web app (a different process than the update worker) can serve it at /metrics.
+
+METRICS_PATH = os.path.join(os.path.dirname(read_db.DB_FILE), 'ingest-metrics.json')
+PREFIX = 'advisory_ingest'
+
+COUNTER_HELP = {
+    'files_read': "Advisory files read",
+    'bytes_read': "Bytes of advisory files read",
+    'cwe_bytes_read': "Bytes of the CWE list read (runs with an unchanged list don't read it)",
+    'changed_files': "Advisory files added or modified since the previous commit",
+    'deleted_files': "Advisory files deleted since the previous commit",
+    'full_reload': "1 if every advisory was reloaded",
+    'unknown_cwes': "Distinct CWE ids referenced by advisories but missing from the CWE list",
+    'database_rebuilt': "1 if a new database was swapped in, 0 if nothing had changed",
+}
+
+
+class Run:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.record = {
+            'started_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'finished_at': None,
+            'success': None,
+            'error': None,
+            'duration_seconds': None,
+            'stages': {}, # stage -> seconds
+            'counters': {}, # name -> value
+            'rows_written': {}, # table -> rows
+        }
+
+_run = Run()
+
+
+def start_run():
+    global _run
+    _run = Run()
+
+@contextmanager
+def stage(name: str):
+    """Times the block and adds it to the stage's total for this run"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_seconds(name, time.perf_counter() - started)
+
+def add_seconds(name: str, seconds: float):
+    stages = _run.record['stages']
+    stages[name] = stages.get(name, 0.0) + seconds
+
+def count(name: str, value: int | float = 1):
+    counters = _run.record['counters']
+    counters[name] = counters.get(name, 0) + value
+
+def count_rows(table: str, rows: int):
+    rows_written = _run.record['rows_written']
+    rows_written[table] = rows_written.get(table, 0) + rows
+
+def finish_run(success: bool, error: str | None = None) -> dict:
+    """Closes the current run and saves it as the last one, returns its record"""
+    record = _run.record
+    record.update(
+        finished_at=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        success=success,
+        error=error,
+        duration_seconds=time.perf_counter() - _run.started,
+    )
+    os.makedirs(os.path.dirname(METRICS_PATH) or '.', exist_ok=True)
+    tmp_path = METRICS_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, METRICS_PATH)
+    return record
+
+def last_run() -> dict:
+    try:
+        with open(METRICS_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def render_prometheus(run: dict, data_version: str | None = None) -> str:
+    """The last run in the Prometheus text exposition format"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{PREFIX}_{name}{{{label_text}}} {value}" if label_text else f"{PREFIX}_{name} {value}")
+
+    if run:
+        finished = run.get('finished_at')
+        metric('last_run_success', 'gauge', "1 if the last ingest run succeeded, 0 if it failed",
+               [({}, 1 if run.get('success') else 0)])
+        if finished:
+            timestamp = datetime.strptime(finished, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+            metric('last_run_timestamp_seconds', 'gauge', "When the last ingest run finished", [({}, int(timestamp))])
+        metric('last_run_duration_seconds', 'gauge', "Wall time of the last ingest run",
+               [({}, round(run.get('duration_seconds') or 0, 6))])
+        metric('stage_seconds', 'gauge', "Time spent per stage in the last ingest run "
+               "(read_files and parse_json are summed over the parser processes)",
+               [({'stage': name}, round(seconds, 6)) for name, seconds in sorted(run.get('stages', {}).items())])
+        metric('rows_written', 'gauge', "Rows inserted per table in the last ingest run",
+               [({'table': table}, rows) for table, rows in sorted(run.get('rows_written', {}).items())])
+        for name, value in sorted(run.get('counters', {}).items()):
+            metric(name, 'gauge', f"{COUNTER_HELP.get(name, name)} in the last ingest run", [({}, value)])
+    if data_version is not None:
+        metric('data_version', 'gauge', "Version of the data being served, bumped by every ingest",
+               [({}, data_version)])
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,6 @@
-from database import db
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
 
 
 advisory_cwe = db.Table(
@@ -9,16 +11,37 @@ advisory_cwe = db.Table(
 
 
 class Advisory(db.Model):
+    # Composite indexes for helpers.filterCVEs: each sort key ends with advisory_id (the keyset tie-breaker)
+    __table_args__ = (
+        db.Index('ix_advisory_published_order', 'published', 'advisory_id'),
+        db.Index('ix_advisory_modified_order', 'modified', 'advisory_id'),
+        db.Index('ix_advisory_withdrawn_order', 'withdrawn', 'advisory_id'),
+        db.Index('ix_advisory_severity_order', 'severity_rank', 'advisory_id'),
+        db.Index('ix_advisory_cve_order', 'cve_year', 'cve_number', 'advisory_id'),
+        db.Index('ix_advisory_severity_published', 'severity', 'published', 'advisory_id'),
+    )
+
     advisory_id = db.Column(db.String, primary_key=True)
-    severity = db.Column(db.String, nullable=False)
+    severity = db.Column(db.String, nullable=False, index=True)
+    severity_rank = db.Column(db.Integer, nullable=False, default=0) # LOW=1 ... CRITICAL=4, for sorting
     summary = db.Column(db.String, nullable=False)
-    details = db.Column(db.Text, nullable=False)
-    cve_id = db.Column(db.String, default=None)
+    cve_id = db.Column(db.String, default=None, index=True)
+    cve_year = db.Column(db.Integer, default=None) # Year part of cve_id, filled in by the ingest
+    cve_number = db.Column(db.Integer, default=None) # Sequence part of cve_id, so CVE-2024-10000 sorts after CVE-2024-9999
     published = db.Column(db.DateTime, nullable=False)
     modified = db.Column(db.DateTime, nullable=False)
     withdrawn = db.Column(db.DateTime, default=None)
     cwes = db.relationship('Cwe', secondary=advisory_cwe, back_populates='advisories')
-    packages = db.relationship('Package', backref='advisory', cascade='all, delete-orphan')
+    affected = db.relationship('AffectedRange', back_populates='advisory', cascade='all, delete-orphan')
+    packages = db.relationship('Package', secondary='affected_range', viewonly=True)
+
+class AdvisoryDetails(db.Model):
+    """The details text of an advisory, zlib-compressed and kept out of the advisory table: it's the
+    largest column by far and only shown when a single advisory is opened, read it through
+    advisory_detail.get_advisory. `id` is the advisory's document id in the full-text index (see fts.py)"""
+    id = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    advisory_id = db.Column(db.String, db.ForeignKey('advisory.advisory_id'), nullable=False, unique=True)
+    details = db.Column(db.LargeBinary, nullable=False) # utils.compress_text
 
 class Cwe(db.Model):
     cwe_id = db.Column(db.Integer, primary_key=True)
@@ -27,17 +50,50 @@ class Cwe(db.Model):
     advisories = db.relationship('Advisory', secondary=advisory_cwe, back_populates='cwes', lazy=True)
 
 class Package(db.Model):
+    """A distinct package, stored once no matter how many advisories affect it"""
+    __table_args__ = (
+        db.UniqueConstraint('package_ecosystem', 'package_name'),
+        db.Index('ix_package_name_ecosystem', 'package_name', 'package_ecosystem'), # Name lookups and project listings
+        db.Index('ix_package_name_key', 'package_ecosystem', 'name_key'), # Dependency scans
+    )
+
     id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    advisory_id = db.Column(db.String, db.ForeignKey('advisory.advisory_id'), nullable=False)
-    package_name = db.Column(db.String, nullable=False)
     package_ecosystem = db.Column(db.String, nullable=False)
+    package_name = db.Column(db.String, nullable=False)
+    name_key = db.Column(db.String, nullable=False) # Normalized name (see versions.normalize_package_name)
+    ranges = db.relationship('AffectedRange', back_populates='package')
+
+class AffectedRange(db.Model):
+    """A version interval of a package affected by an advisory, one per introduced event of each range"""
+    id = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    advisory_id = db.Column(db.String, db.ForeignKey('advisory.advisory_id'), nullable=False, index=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('package.id'), nullable=False, index=True)
+    range_type = db.Column(db.String) # ECOSYSTEM, SEMVER or GIT
     introduced_version = db.Column(db.String)
     fixed_version = db.Column(db.String)
+    last_affected_version = db.Column(db.String)
+    advisory = db.relationship('Advisory', back_populates='affected')
+    package = db.relationship('Package', back_populates='ranges')
+
+class CveYearCount(db.Model):
+    """Advisories with a CVE id counted per CVE year, published year and severity (see rollups.py)"""
+    cve_year = db.Column(db.Integer, primary_key=True)
+    published_year = db.Column(db.Integer, primary_key=True)
+    severity = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+class CweRollup(db.Model):
+    """Advisories counted per CWE, published year, severity and ecosystem (see rollups.py).
+    The ecosystem '*' row counts each advisory once across all its ecosystems"""
+    __table_args__ = (db.Index('ix_cwe_rollup_slice', 'ecosystem', 'published_year', 'severity'),)
+
+    cwe_id = db.Column(db.Integer, primary_key=True)
+    published_year = db.Column(db.Integer, primary_key=True)
+    severity = db.Column(db.String, primary_key=True)
+    ecosystem = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
 
-    # This is needed for the utils.remove_duplicates function
-    def __eq__(self, other):
-        return (self.advisory_id == other.advisory_id and
-                self.package_name == other.package_name and
-                self.package_ecosystem == other.package_ecosystem and
-                self.introduced_version == other.introduced_version and
-                self.fixed_version == other.fixed_version)
+class Meta(db.Model):
+    """Key/value bookkeeping for the ingest (e.g. the last ingested commit)"""
+    key = db.Column(db.String, primary_key=True)
+    value = db.Column(db.String)
@@ -0,0 +1,86 @@
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import text
+
+import read_db
+
+# In-memory typeahead over advisory ids, CVE ids and CWE ids, so the search dropdown
+# doesn't hit the database on every keystroke
+
+CHECK_INTERVAL = 30 # seconds between checks of the data version
+
+_index = None
+_version = None
+_checked_at = 0.0
+_rebuild_lock = threading.Lock()
+
+
+class PrefixIndex:
+    """Entries sorted by lowercased key, a prefix lookup is one bisect plus a short scan"""
+
+    def __init__(self, entries: list[tuple[str, str, str]]):
+        # entries are (key, label, advisory_id)
+        entries.sort()
+        self._keys = [key for key, _, _ in entries]
+        self._options = [(label, advisory_id) for _, label, advisory_id in entries]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, prefix: str, limit: int = 10) -> list[dict]:
+        """Returns dropdown options ({'label', 'value'}) for the first `limit` advisories matching the prefix"""
+        prefix = prefix.strip().lower()
+        options = []
+        seen = set()
+        for i in range(bisect_left(self._keys, prefix), len(self._keys)):
+            if len(options) >= limit or not self._keys[i].startswith(prefix):
+                break
+            label, advisory_id = self._options[i]
+            if advisory_id not in seen:
+                seen.add(advisory_id)
+                options.append({'label': label, 'value': advisory_id})
+        return options
+
+
+def build_index() -> PrefixIndex:
+    entries = []
+    with read_db.get_session() as session:
+        for advisory_id, cve_id in session.execute(text("SELECT advisory_id, cve_id FROM advisory")):
+            entries.append((advisory_id.lower(), advisory_id, advisory_id))
+            if cve_id:
+                entries.append((cve_id.lower(), f"{cve_id} ({advisory_id})", advisory_id))
+
+        for advisory_id, cwe_id in session.execute(text("SELECT advisory_id, cwe_id FROM advisory_cwe")):
+            entries.append((f"cwe-{cwe_id}", f"CWE-{cwe_id} ({advisory_id})", advisory_id))
+
+    return PrefixIndex(entries)
+
+def rebuild():
+    """Builds a new index and swaps it in, readers keep using the old one until then"""
+    global _index, _version
+    version = read_db.get_data_version()
+    index = build_index()
+    _index, _version = index, version
+
+def get_index() -> PrefixIndex:
+    """Returns the current index, rebuilding it if the ingest committed new data since it was built"""
+    global _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < CHECK_INTERVAL:
+        return _index
+
+    # Only one thread rebuilds, the others carry on with the old index (if there is one)
+    if _rebuild_lock.acquire(blocking=_index is None):
+        try:
+            if _index is None or time.monotonic() - _checked_at >= CHECK_INTERVAL:
+                _checked_at = time.monotonic()
+                if _index is None or read_db.get_data_version() != _version:
+                    rebuild()
+        finally:
+            _rebuild_lock.release()
+    return _index
+
+def search(prefix: str, limit: int = 10) -> list[dict]:
+    return get_index().search(prefix, limit)
@@ -0,0 +1,107 @@
+import os
+import threading
+
+from sqlalchemy import create_engine, event, text, bindparam, MetaData, Table
+from sqlalchemy.exc import OperationalError, DisconnectionError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+# Process-wide read-only access to advisory.db for the Dash callbacks and Flask views.
+# The file is never written in place: the ingest (database.py) builds a new one and renames it over
+# DB_FILE. Pooled connections notice that on checkout and reconnect, so a refresh needs no restart.
+# Windows can't rename over a file another process has open, so there connections aren't pooled:
+# the file is only open while a query runs, and the ingest's swap (database.swap_in) retries around that.
+
+# Flask-SQLAlchemy resolves 'sqlite:///advisory.db' relative to the app's instance folder
+DB_FILE = os.path.join('instance', 'advisory.db')
+
+POOL_SIZE = 8
+MMAP_SIZE = 256 * 1024 * 1024 # bytes
+CACHE_SIZE = -64 * 1024 # negative means KiB, so 64 MiB per connection
+
+_engine = None
+_data_version = (None, None) # (file id, data version) of the last lookup
+_metadata = MetaData()
+_lock = threading.Lock()
+
+
+def _file_id():
+    """Identifies the file currently at DB_FILE, it changes when the ingest swaps in a new one"""
+    try:
+        stat = os.stat(DB_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+def _record_file_id(dialect, connection_record, cargs, cparams):
+    # Taken before connecting: if the file is swapped in between, the next checkout just reconnects once
+    connection_record.info['file_id'] = _file_id()
+
+def _check_file_id(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info.get('file_id') != _file_id():
+        raise DisconnectionError("advisory.db was replaced") # The pool drops the connection and opens a new one
+
+def _tune_connection(dbapi_connection, _):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def get_engine():
+    """Returns the shared engine, creating it on first use"""
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                if os.name == 'nt':
+                    engine = create_engine("sqlite:///" + DB_FILE, poolclass=NullPool)
+                else:
+                    engine = create_engine("sqlite:///" + DB_FILE, pool_size=POOL_SIZE, max_overflow=POOL_SIZE)
+                event.listen(engine, 'do_connect', _record_file_id)
+                event.listen(engine, 'connect', _tune_connection)
+                event.listen(engine, 'checkout', _check_file_id)
+                _engine = engine
+    return _engine
+
+def release_connections():
+    """Closes the idle pooled connections (checked out ones are closed when they come back)"""
+    if _engine is not None:
+        _engine.dispose()
+
+def get_session() -> Session:
+    """Returns a new session on the shared engine, use it as a context manager"""
+    return Session(bind=get_engine())
+
+def get_table(name: str) -> Table:
+    """Returns the reflected table, reflecting it only the first time it's asked for"""
+    table = _metadata.tables.get(name)
+    if table is None:
+        engine = get_engine() # Outside the lock, get_engine takes it too
+        with _lock:
+            table = _metadata.tables.get(name)
+            if table is None:
+                table = Table(name, _metadata, autoload_with=engine)
+    return table
+
+def get_meta(*keys: str) -> dict[str, str]:
+    """Reads values the ingest keeps in the meta table (missing keys are left out)"""
+    try:
+        with get_engine().connect() as conn:
+            rows = conn.execute(text("SELECT key, value FROM meta WHERE key IN :keys")
+                                .bindparams(bindparam('keys', expanding=True)), {"keys": list(keys)})
+            return dict(rows.fetchall())
+    except OperationalError: # No meta table yet
+        return {}
+
+def get_data_version() -> str | None:
+    """Returns the version the ingest bumps on every commit (None before the first load).
+    A file is never changed once swapped in, so the version is only read again when the file is replaced"""
+    global _data_version
+    file_id, version = _data_version
+    current_file_id = _file_id()
+    if current_file_id is None or current_file_id != file_id:
+        version = get_meta('data_version').get('data_version')
+        _data_version = (current_file_id, version)
+    return version
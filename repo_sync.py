@@ -0,0 +1,95 @@
+import os
+import subprocess
+
+# Keeps the local copy of the advisory database in sync with as little transfer and disk as possible:
+# a shallow, blobless clone with only advisories/github-reviewed checked out (the unreviewed tree is
+# much larger and never read). Git always runs with cwd=REPO_PATH, the process working directory is left alone.
+
+# The remote can be pointed at a local mirror (a path or file:// url), e.g. for offline runs
+REPO_URL = os.environ.get('ADVISORY_REPO_URL', 'https://github.com/github/advisory-database.git')
+REPO_BRANCH = os.environ.get('ADVISORY_REPO_BRANCH', 'main')
+DATA_PATH = 'data'
+#os.path.join is to ensure crossplatform compatibility
+REPO_PATH = os.path.join(DATA_PATH, 'advisory-database')
+ADVISORY_DIR = 'advisories/github-reviewed'
+
+
+def git(*args: str, cwd: str | None = REPO_PATH) -> str:
+    """Runs a git command and returns its stdout, raises subprocess.CalledProcessError on failure"""
+    output = subprocess.check_output(['git', *args], cwd=cwd, stderr=subprocess.PIPE)
+    return output.decode('utf-8').strip()
+
+def remote_url() -> str:
+    # Plain local paths are cloned with hardlinks, which ignores --depth and --filter; a file:// url doesn't
+    if os.path.isdir(REPO_URL):
+        return 'file://' + os.path.abspath(REPO_URL)
+    return REPO_URL
+
+def repo_exists() -> bool:
+    return os.path.exists(REPO_PATH)
+
+def init_repo() -> bool:
+    """Clones the advisory repo: latest commit only, no blobs up front, only ADVISORY_DIR checked out"""
+    if repo_exists():
+        return True
+
+    print("Cloning Advisory Database...")
+    try:
+        git('clone', '--depth=1', '--filter=blob:none', '--sparse', '--single-branch', '-b', REPO_BRANCH,
+            remote_url(), REPO_PATH, cwd=None)
+        git('sparse-checkout', 'set', ADVISORY_DIR)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Failed to clone the advisory repository: {e.stderr.decode('utf-8', 'replace').strip()}") from e
+
+    return True
+
+def update_repo() -> bool:
+    """Fetches the latest commit and checks it out. Returns True if the checked out commit changed"""
+    if not repo_exists():
+        return init_repo()
+
+    print("Updating Advisory Database...")
+    try:
+        # Older clones (full checkout) are narrowed down to ADVISORY_DIR the first time
+        if git('config', '--bool', '--default', 'false', 'core.sparseCheckout') != 'true':
+            git('sparse-checkout', 'set', ADVISORY_DIR)
+        git('remote', 'set-url', 'origin', remote_url())
+
+        old_head = get_repo_head()
+        git('fetch', '--depth=1', '--filter=blob:none', 'origin', REPO_BRANCH)
+        new_head = git('rev-parse', 'FETCH_HEAD')
+        if new_head == old_head:
+            print("Local database is already up to date.")
+            return False
+
+        # The shallow history has no common ancestor to merge from, the fetched commit just replaces the old one
+        git('reset', '--hard', '--quiet', new_head)
+    except subprocess.CalledProcessError as e:
+        raise Exception("Failed to pull the latest changes in the advisory-database: "
+                        f"{e.stderr.decode('utf-8', 'replace').strip()}") from e
+
+    print(f"Advisory Database updated from {old_head[:12]} to {new_head[:12]}")
+    return True
+
+def get_repo_head() -> str:
+    """Returns the commit hash currently checked out in the advisory repo"""
+    return git('rev-parse', 'HEAD')
+
+def get_changed_files(old_commit: str, new_commit: str) -> tuple[set[str], set[str]] | None:
+    """Lists the advisory files added/modified and deleted between two commits.
+    Returns None if the diff can't be computed (e.g. the old commit is not in the shallow history)"""
+    try:
+        output = git('diff', '--name-status', '--no-renames', old_commit, new_commit, '--', ADVISORY_DIR)
+    except subprocess.CalledProcessError:
+        return None
+
+    changed, deleted = set(), set()
+    for line in output.splitlines():
+        status, path = line.split('\t', 1)
+        if not path.endswith('.json'):
+            continue
+        if status == 'D':
+            deleted.add(path)
+        else:
+            changed.add(path)
+    return changed, deleted
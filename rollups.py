@@ -0,0 +1,99 @@
+from sqlalchemy import text, bindparam
+
+import utils
+
+# Aggregates the ingest keeps up to date, so dashboard views read a few hundred rows
+# instead of grouping the whole advisory table on every request.
+# database.write_advisories adds the advisories it inserts and database.delete_advisories
+# subtracts the ones it removes, which keeps the counts right under incremental updates.
+
+ROLLUP_TABLES = ['cve_year_count', 'cwe_rollup']
+ALL_ECOSYSTEMS = '*'
+
+CVE_YEAR_COUNT_DELTA = text("""
+    INSERT INTO cve_year_count (cve_year, published_year, severity, count)
+    SELECT cve_year, CAST(strftime('%Y', published) AS INTEGER), severity, :sign * COUNT(*)
+    FROM advisory
+    WHERE advisory_id IN :ids AND cve_year IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (cve_year, published_year, severity) DO UPDATE SET count = count + excluded.count
+""").bindparams(bindparam('ids', expanding=True))
+
+CWE_ROLLUP_DELTA = text(f"""
+    INSERT INTO cwe_rollup (cwe_id, published_year, severity, ecosystem, count)
+    SELECT advisory_cwe.cwe_id, CAST(strftime('%Y', advisory.published) AS INTEGER), advisory.severity,
+           ecosystems.ecosystem, :sign * COUNT(*)
+    FROM advisory_cwe
+    JOIN advisory ON advisory.advisory_id = advisory_cwe.advisory_id
+    JOIN (
+        SELECT DISTINCT affected_range.advisory_id, package.package_ecosystem AS ecosystem
+        FROM affected_range JOIN package ON package.id = affected_range.package_id
+        WHERE affected_range.advisory_id IN :ids
+        UNION ALL
+        SELECT advisory_id, '{ALL_ECOSYSTEMS}' FROM advisory WHERE advisory_id IN :ids
+    ) AS ecosystems ON ecosystems.advisory_id = advisory.advisory_id
+    WHERE advisory_cwe.advisory_id IN :ids
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (cwe_id, published_year, severity, ecosystem) DO UPDATE SET count = count + excluded.count
+""").bindparams(bindparam('ids', expanding=True))
+
+
+def clear(conn):
+    for table in ROLLUP_TABLES:
+        conn.execute(text(f"DELETE FROM {table}"))
+
+def add_advisories(conn, advisory_ids: list[str]):
+    """Counts advisories that were just inserted (with their packages and cwe links)"""
+    _apply_delta(conn, advisory_ids, 1)
+
+def subtract_advisories(conn, advisory_ids: list[str]):
+    """Uncounts advisories that are about to be deleted"""
+    _apply_delta(conn, advisory_ids, -1)
+
+def _apply_delta(conn, advisory_ids: list[str], sign: int):
+    for ids in utils.chunks(advisory_ids, 500):
+        conn.execute(CVE_YEAR_COUNT_DELTA, {"ids": ids, "sign": sign})
+        conn.execute(CWE_ROLLUP_DELTA, {"ids": ids, "sign": sign})
+    if sign < 0:
+        for table in ROLLUP_TABLES:
+            conn.execute(text(f"DELETE FROM {table} WHERE count = 0"))
+
+def cve_counts_by_year(conn, start_year: int, end_year: int, published_since: int | None = None) -> dict[int, int]:
+    """Number of advisories per CVE year in [start_year, end_year], optionally only those published
+    in or after `published_since`. Every year in the range is in the result, 0 if it has none"""
+    sql = "SELECT cve_year, SUM(count) FROM cve_year_count WHERE cve_year BETWEEN :start AND :end"
+    if published_since is not None:
+        sql += " AND published_year >= :published_since"
+    sql += " GROUP BY cve_year"
+
+    counts = {year: 0 for year in range(start_year, end_year + 1)}
+    rows = conn.execute(text(sql), {"start": start_year, "end": end_year, "published_since": published_since})
+    for year, count in rows:
+        counts[year] = count
+    return counts
+
+def top_cwes(conn, limit: int = 10, years: list[int] | None = None, severity: str | None = None,
+             ecosystem: str | None = None) -> list:
+    """Most common CWEs, optionally only for advisories published in `years`, of a severity or
+    affecting an ecosystem. Returns rows of (cwe_id, name, count), most advisories first"""
+    sql = ("SELECT cwe_rollup.cwe_id, cwe.name, SUM(cwe_rollup.count) AS count "
+           "FROM cwe_rollup JOIN cwe ON cwe.cwe_id = cwe_rollup.cwe_id "
+           "WHERE cwe_rollup.ecosystem = :ecosystem")
+    params = {"ecosystem": ecosystem or ALL_ECOSYSTEMS, "limit": limit}
+    if years:
+        sql += " AND cwe_rollup.published_year IN :years"
+        params["years"] = list(years)
+    if severity:
+        sql += " AND cwe_rollup.severity = :severity"
+        params["severity"] = severity
+    sql += " GROUP BY cwe_rollup.cwe_id ORDER BY count DESC, cwe_rollup.cwe_id LIMIT :limit"
+
+    query = text(sql)
+    if years:
+        query = query.bindparams(bindparam('years', expanding=True))
+    return conn.execute(query, params).fetchall()
+
+def top_cwes_by_year(conn, start_year: int, end_year: int, limit: int = 5, severity: str | None = None,
+                     ecosystem: str | None = None) -> dict[int, list]:
+    """top_cwes for each year in [start_year, end_year]"""
+    return {year: top_cwes(conn, limit, [year], severity, ecosystem) for year in range(start_year, end_year + 1)}
@@ -1,78 +1,182 @@
-import re
 from app import app
-from flask import render_template
+from flask import render_template, request, jsonify, url_for, Response, stream_with_context
 from models import *
-from matplotlib import pyplot as plt
+import advisory_detail
+import chart_cache
+import depscan
+import export
+import fts
+import metrics
+import read_db
+import rollups
+import worker
 
 from datetime import datetime
-from sqlalchemy import func
+
+CHART_MIN_YEAR = 1999 # The first CVE ids
+CHART_MAX_YEARS = 50
 
 @app.route('/')
 def index():
-    cwe = Cwe.query.get(77)
+    with read_db.get_session() as session:
+        cwe = session.get(Cwe, 77)
 
     return f"Testing DB call to CWE-77:<br><br>ID: {cwe.cwe_id}<br>Name: {cwe.name}<br>Description: {cwe.description}"
 
 # This is an example, change this when we have a proper page for it.
+# Optional filters: ?year=2023&year=2024&severity=HIGH&ecosystem=npm
 @app.route('/top-10-cwes')
 def top_10_cwes():
-    cwes = Cwe.query.join(advisory_cwe) \
-        .with_entities(Cwe.cwe_id, Cwe.name, func.count(Cwe.cwe_id).label('count')) \
-        .group_by(Cwe.cwe_id) \
-        .order_by(func.count(Cwe.cwe_id).desc()) \
-        .limit(10)
+    with read_db.get_session() as session:
+        cwes = rollups.top_cwes(session, 10, **get_cwe_slice())
 
     return f"Top 10 CWEs:<br><br>" + "<br>".join([f"Matches ({cwe.count}): CWE-{cwe.cwe_id}: {cwe.name}" for cwe in cwes])
 
+@app.route('/api/top-cwes')
+def top_cwes_api():
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    with read_db.get_session() as session:
+        cwes = rollups.top_cwes(session, limit, **get_cwe_slice())
+
+    return jsonify([{"cwe_id": cwe.cwe_id, "name": cwe.name, "count": cwe.count} for cwe in cwes])
+
+@app.route('/yearly-cwes')
+def yearly_cwes():
+    current_year = datetime.utcnow().year
+    start_year = current_year - 9  # Last 10 years
+    cwe_slice = get_cwe_slice()
+    cwe_slice.pop('years')
+
+    with read_db.get_session() as session:
+        yearly = rollups.top_cwes_by_year(session, start_year, current_year, 5, **cwe_slice)
+
+    return render_template(
+        'yearly_cwes.html',
+        start_year=start_year,
+        end_year=current_year,
+        severity=cwe_slice['severity'],
+        ecosystem=cwe_slice['ecosystem'],
+        yearly=yearly
+    )
+
+def get_cwe_slice():
+    """Reads the rollup filters (year, severity, ecosystem) from the query string"""
+    return {
+        "years": request.args.getlist('year', type=int),
+        "severity": request.args.get('severity', type=str.upper),
+        "ecosystem": request.args.get('ecosystem'),
+    }
+
+@app.route('/api/search')
+def search():
+    """Ranked full-text search over advisory summaries and details, e.g. /api/search?q=path traversal in tar"""
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    with read_db.get_session() as session:
+        rows = fts.search_advisories(session, request.args.get('q', ''), limit=limit)
+
+    return jsonify([
+        {"advisory_id": row.advisory_id, "cve_id": row.cve_id, "severity": row.severity,
+         "summary": row.summary, "snippet": row.snippet}
+        for row in rows
+    ])
+
+@app.route('/api/advisories/<advisory_id>')
+def advisory_api(advisory_id):
+    """One advisory with its CWEs and affected packages"""
+    advisory = advisory_detail.get_advisory(advisory_id)
+    if advisory is None:
+        return jsonify({"error": f"Unknown advisory '{advisory_id}'"}), 404
+    return jsonify(advisory_detail.to_json(advisory))
+
+@app.route('/api/scan', methods=['POST'])
+def scan():
+    """Matches a dependency list against the affected ranges. Send the file as a multipart upload
+    ('file') or as the request body, ?format=requirements|package-lock|cyclonedx when its name doesn't tell"""
+    upload = request.files.get('file')
+    if upload is not None:
+        content, filename = upload.read().decode('utf-8', errors='replace'), upload.filename
+    else:
+        content, filename = request.get_data(as_text=True), request.args.get('filename')
+
+    try:
+        dependencies = depscan.parse_dependencies(content, filename, request.args.get('format'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with read_db.get_session() as session:
+        return jsonify(depscan.scan(session, dependencies))
+
+@app.route('/api/export/<dataset>')
+def export_dataset(dataset):
+    """Streams a whole dataset (advisories, affected or cwes) as NDJSON or CSV, e.g.
+    /api/export/advisories?format=csv&modified_since=2024-01-01&severity=high&ecosystem=npm&include_withdrawn=false"""
+    file_format = request.args.get('format', 'ndjson')
+    try:
+        chunks = export.stream(dataset, file_format, export.parse_filters(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(stream_with_context(chunks), mimetype=export.FORMATS[file_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{dataset}.{file_format}"'
+    return response
+
+@app.route('/api/update-status')
+def update_status():
+    """State, stage and result of the current or last database update (see worker.py)"""
+    return jsonify(worker.read_status())
+
+@app.route('/metrics')
+def ingest_metrics():
+    """Timings and counters of the last ingest run, in the Prometheus text format"""
+    text = metrics.render_prometheus(metrics.last_run(), read_db.get_data_version())
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
 @app.route('/cve-trend')
 def cve_trend():
     prefix = "CVE"
     current_year = datetime.utcnow().year
     start_year = current_year - 9  # Last 10 years
-    year_counts = {year: 0 for year in range(start_year, current_year + 1)}
-
-    # Query all advisories with non-null CVE IDs and within date range
-    advisories = (
-        Advisory.query
-        .filter(Advisory.cve_id != None)
-        .filter(Advisory.published >= datetime(start_year, 1, 1))
-        .all()
-    )
-
-    # Count CVEs per year using regex on CVE IDs
-    for advisory in advisories:
-        match = re.match(rf'{prefix}-(\d{{4}})-\d+', advisory.cve_id)
-        if match:
-            year = int(match.group(1))
-            if start_year <= year <= current_year:
-                year_counts[year] += 1
-
-    # Create bar chart
-    years = list(year_counts.keys())
-    counts = list(year_counts.values())
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.bar(years, counts, color='#3478c0')
-    ax.set_title("Annual Distribution of Published CVE Records (Last 10 Years)")
-    ax.set_xlabel("Year")
-    ax.set_ylabel("Number of CVEs")
-    plt.xticks(years, rotation=45)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    chart_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
 
     return render_template(
         'cve_trend.html',
         prefix=prefix,
         start_year=start_year,
         end_year=current_year,
-        chart=chart_base64,
-        year_counts=year_counts
+        chart_url=url_for('cve_trend_chart', start_year=start_year, end_year=current_year),
+        year_counts=get_cve_year_counts(start_year, current_year)
     )
 
+@app.route('/charts/cve-trend/<int:start_year>-<int:end_year>.png')
+def cve_trend_chart(start_year, end_year):
+    # Every year is a bar and every range a cache entry, only reasonable ranges are drawn
+    current_year = datetime.utcnow().year
+    if not (CHART_MIN_YEAR <= start_year <= end_year <= current_year + 1 and end_year - start_year < CHART_MAX_YEARS):
+        return jsonify({"error": f"Invalid year range, expected at most {CHART_MAX_YEARS} years "
+                                 f"between {CHART_MIN_YEAR} and {current_year + 1}"}), 404
+
+    def render():
+        year_counts = get_cve_year_counts(start_year, end_year)
+        return chart_cache.render_bar_chart(
+            list(year_counts.keys()), list(year_counts.values()),
+            title=f"Annual Distribution of Published CVE Records ({start_year} - {end_year})",
+            xlabel="Year",
+            ylabel="Number of CVEs",
+        )
+
+    return chart_response(chart_cache.get_chart('cve-trend', (start_year, end_year), render))
 
+def get_cve_year_counts(start_year, end_year):
+    # Advisories per CVE year (published within the range), precomputed by the ingest
+    with read_db.get_session() as session:
+        return rollups.cve_counts_by_year(session, start_year, end_year, published_since=start_year)
 
+def chart_response(chart):
+    """Serves a cached chart like a static file: browsers revalidate with If-None-Match /
+    If-Modified-Since and get a 304 until the next ingest changes the data"""
+    response = Response(chart.png, mimetype='image/png')
+    response.set_etag(chart.etag)
+    if chart.last_modified is not None:
+        response.last_modified = chart.last_modified
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+
+import database
+import utils
+import worker
+
+# Snapshots of the ingested database, so a new node can start serving without cloning the advisory
+# repo and parsing every file. A snapshot is one JSON header line (format, schema and data versions,
+# the commit it was built from, checksum) followed by a gzipped, vacuumed copy of advisory.db.
+
+SNAPSHOT_FORMAT = 'advisory-snapshot/1'
+META_KEYS = ('schema_version', 'data_version', 'data_updated_at', 'last_commit', 'cwe_hash')
+
+
+def export_snapshot(out_path: str, db_path: str = database.DB_PATH) -> dict:
+    """Writes a snapshot of `db_path` to `out_path`, returns its header"""
+    image_path = out_path + '.image'
+    if os.path.exists(image_path):
+        os.remove(image_path)
+
+    # VACUUM INTO writes a compact, consistent copy even while the app is reading (or the ingest writing)
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        source.execute("VACUUM INTO ?", (image_path,))
+        meta = dict(source.execute(
+            f"SELECT key, value FROM meta WHERE key IN ({', '.join('?' * len(META_KEYS))})", META_KEYS))
+    finally:
+        source.close()
+
+    try:
+        image = sqlite3.connect(image_path)
+        image.execute("PRAGMA journal_mode=DELETE") # A single file, no -wal to ship along
+        image.close()
+
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            **{key: meta.get(key) for key in META_KEYS},
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'size': os.path.getsize(image_path),
+            'sha256': utils.file_sha256(image_path),
+        }
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(json.dumps(header).encode('utf-8') + b'\n')
+            with open(image_path, 'rb') as image_file, gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as gz:
+                shutil.copyfileobj(image_file, gz, 1 << 20)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(image_path):
+            os.remove(image_path)
+    return header
+
+def read_header(path: str) -> dict:
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+    if header.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not an advisory snapshot")
+    return header
+
+def import_snapshot(path: str, db_path: str = database.DB_PATH) -> dict:
+    """Replaces `db_path` with the database in the snapshot, returns the snapshot header.
+    Must run before anything opens the database (the files are swapped underneath it). It holds the
+    update lock (see worker.py) so a running update can't swap its own database over the import"""
+    header = read_header(path)
+    if header['schema_version'] != database.SCHEMA_VERSION:
+        raise ValueError(f"Snapshot has schema version {header['schema_version']}, "
+                         f"this version of the app needs {database.SCHEMA_VERSION}")
+
+    lock = worker.acquire_lock()
+    if lock is None:
+        raise ValueError("A database update is running, import the snapshot once it's done")
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = db_path + '.import'
+    try:
+        with open(path, 'rb') as f:
+            f.readline()
+            with gzip.GzipFile(fileobj=f, mode='rb') as gz, open(tmp_path, 'wb') as out:
+                shutil.copyfileobj(gz, out, 1 << 20)
+
+        if utils.file_sha256(tmp_path) != header['sha256']:
+            raise ValueError(f"{path} is corrupt (checksum mismatch)")
+
+        # The -wal/-shm of the old database must not be applied to the new one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        database.swap_in(tmp_path, db_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        lock.close()
+    return header
+
+def is_newer_than_db(header: dict, db_path: str = database.DB_PATH) -> bool:
+    """Whether the snapshot holds newer data than the local database (or there is no usable local database)"""
+    if not os.path.exists(db_path):
+        return True
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            local = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('schema_version', 'data_updated_at')"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return True
+    if local.get('schema_version') != database.SCHEMA_VERSION:
+        return True
+    return (header.get('data_updated_at') or '') > (local.get('data_updated_at') or '')
@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+from datetime import datetime
+
+import pytest
+
+import database
+import metrics
+import read_db
+import repo_sync
+from bench import generate_corpus
+
+# An incremental ingest (only the files changed since the last commit, with the rollups and the
+# contentless full-text index updated by deltas) has to leave the same data as a full rebuild
+
+TABLES = {
+    'advisory': "SELECT * FROM advisory ORDER BY advisory_id",
+    'advisory_details': "SELECT advisory_id, details FROM advisory_details ORDER BY advisory_id",
+    'package': "SELECT package_ecosystem, package_name, name_key FROM package ORDER BY 1, 2",
+    # Ids differ between the two runs, ranges are compared by their advisory and package
+    'affected_range': """
+        SELECT advisory_id, package_ecosystem, package_name, range_type,
+               introduced_version, fixed_version, last_affected_version
+        FROM affected_range JOIN package ON package.id = affected_range.package_id
+        ORDER BY 1, 2, 3, 4, 5, 6, 7""",
+    'advisory_cwe': "SELECT advisory_id, cwe_id FROM advisory_cwe ORDER BY 1, 2",
+    'cve_year_count': "SELECT * FROM cve_year_count ORDER BY 1, 2, 3",
+    'cwe_rollup': "SELECT * FROM cwe_rollup ORDER BY 1, 2, 3, 4",
+}
+# Every document still indexed under a word, also the ones whose row is gone (a missed delete shows up as None)
+FTS_MATCHES = """
+    SELECT advisory_details.advisory_id FROM advisory_fts
+    LEFT JOIN advisory_details ON advisory_details.id = advisory_fts.rowid
+    WHERE advisory_fts MATCH :word
+    ORDER BY 1
+"""
+MARKER = 'quokka' # Only in the modified and added advisories
+
+
+def snapshot(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("INSERT INTO advisory_fts (advisory_fts, rank) VALUES ('integrity-check', 0)")
+        data = {table: conn.execute(sql).fetchall() for table, sql in TABLES.items()}
+        data['fts'] = {word: conn.execute(FTS_MATCHES, {"word": word}).fetchall()
+                       for word in (*generate_corpus.WORDS, MARKER)}
+    finally:
+        conn.close()
+    return data
+
+def advisory_files(repo: str) -> list[str]:
+    root = os.path.join(repo, repo_sync.ADVISORY_DIR)
+    return sorted(os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names)
+
+def write_advisory(repo: str, advisory: dict):
+    published = advisory['published']
+    folder = os.path.join(repo, repo_sync.ADVISORY_DIR, published[:4], published[5:7], advisory['id'])
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, advisory['id'] + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(advisory, f, indent=2)
+
+def change_corpus(repo: str):
+    """Commits 3 deleted, 3 modified and 3 new advisories"""
+    rng = random.Random(2)
+    files = advisory_files(repo)
+    for path in files[:3]:
+        shutil.rmtree(os.path.dirname(path))
+
+    for i, path in enumerate(files[3:6]):
+        with open(path, encoding='utf-8') as f:
+            advisory = json.load(f)
+        advisory['summary'] = f"{MARKER} {advisory['summary']}"
+        advisory['details'] = generate_corpus.sentence(rng, 30)
+        advisory['database_specific']['severity'] = 'CRITICAL' if advisory['database_specific']['severity'] != 'CRITICAL' else 'LOW'
+        advisory['database_specific']['cwe_ids'] = advisory['database_specific']['cwe_ids'][1:]
+        advisory['affected'] = [{'package': {'ecosystem': 'npm', 'name': f"{MARKER}-{i}"},
+                                 'ranges': generate_corpus.ranges(rng, 'npm')}]
+        if i == 0:
+            advisory['aliases'] = []
+        if i == 1:
+            advisory['withdrawn'] = advisory['modified']
+        write_advisory(repo, advisory)
+
+    with open(files[6], encoding='utf-8') as f:
+        packages = [(affected['package']['ecosystem'], affected['package']['name']) for affected in json.load(f)['affected']]
+    for i in range(3):
+        advisory = generate_corpus.make_advisory(rng, 1000 + i, packages + [('PyPI', MARKER)], [79, 89, 1321], datetime(2020, 1, 1))
+        advisory['summary'] = f"{MARKER} {advisory['summary']}"
+        write_advisory(repo, advisory)
+
+    git = ['git', '-c', 'user.name=corpus', '-c', 'user.email=corpus@localhost']
+    subprocess.run(['git', 'add', '-A'], cwd=repo, check=True)
+    subprocess.run(git + ['commit', '-q', '-m', "Add, modify and delete advisories"], cwd=repo, check=True)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    corpus = tmp_path / 'corpus'
+    generate_corpus.generate(str(corpus), advisories=60, packages=20, cwes=30, seed=1)
+
+    # The app resolves data/ and instance/ relative to the working directory
+    work = tmp_path / 'work'
+    (work / 'data').mkdir(parents=True)
+    shutil.copy(corpus / 'cwe_list.xml', work / 'data' / 'cwe_list.xml')
+    monkeypatch.chdir(work)
+    monkeypatch.setattr(repo_sync, 'REPO_URL', str(corpus / 'advisory-database'))
+    yield str(corpus / 'advisory-database')
+    read_db.release_connections()
+
+
+def test_incremental_update_matches_full_rebuild(workdir):
+    assert database.update_db()
+    change_corpus(workdir)
+
+    assert database.update_db()
+    counters = metrics.last_run()['counters']
+    assert 'full_reload' not in counters
+    assert (counters['changed_files'], counters['deleted_files']) == (6, 3)
+    incremental = snapshot(database.DB_PATH)
+
+    with database.shadow_database() as conn:
+        database.load_repo_data(conn, full=True)
+    full = snapshot(database.DB_PATH)
+
+    assert len(full['advisory']) == 60
+    assert len(full['fts'][MARKER]) == 6
+    for name in full:
+        assert incremental[name] == full[name], name
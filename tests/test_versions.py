@@ -0,0 +1,66 @@
+import pytest
+
+import depscan
+from versions import version_key, normalize_package_name
+
+
+@pytest.mark.parametrize('ecosystem, lower, higher', [
+    ('PyPI', '1.0rc1', '1.0'),
+    ('PyPI', '1.9', '1.10'),
+    ('PyPI', '2.0.post1', '2.0.1'),
+    ('npm', '1.0.0-alpha', '1.0.0-alpha.1'),
+    ('npm', '1.0.0-alpha.1', '1.0.0-beta'),
+    ('npm', '1.0.0-rc.1', '1.0.0'),
+    ('npm', '1.2.9', '1.10.0'),
+    ('Go', 'v0.9.0', 'v0.10.0'),
+    ('Maven', '1.0-beta', '1.0'),
+    ('Maven', '1.0', '1.0.1'),
+    ('Maven', '4.3.29.RELEASE', '4.3.30'),
+    ('Maven', '2.0.Final', '2.0.1'),
+    ('NuGet', '2.0', '2.0.1'),
+    ('RubyGems', '1.9.9', '1.10'),
+    ('Packagist', '5.4.9', '5.4.10'),
+])
+def test_ordering(ecosystem, lower, higher):
+    assert version_key(ecosystem, lower) < version_key(ecosystem, higher)
+
+
+@pytest.mark.parametrize('ecosystem, version, same', [
+    ('PyPI', '1.0', '1.0.0'),
+    ('npm', 'v1.2.3', '1.2.3'),
+    ('npm', '1.2.3+build.5', '1.2.3'),
+    ('NuGet', '2.0', '2.0.0'),
+    ('NuGet', '2', '2.0.0.0'),
+    ('RubyGems', '3.1', '3.1.0'),
+    ('Maven', '4.3.30.RELEASE', '4.3.30'),
+    ('Maven', '1.2.Final', '1.2.0'),
+    ('Maven', '5.0-GA', '5'),
+    ('Maven', '1.0.0-beta', '1.0-beta'),
+    ('Maven', '0', '0.0'),
+])
+def test_equal(ecosystem, version, same):
+    assert version_key(ecosystem, version) == version_key(ecosystem, same)
+
+
+def test_release_qualifiers_are_maven_only():
+    # Elsewhere a trailing word is a pre-release
+    assert version_key('RubyGems', '1.0.final') < version_key('RubyGems', '1.0')
+
+
+@pytest.mark.parametrize('ecosystem, fixed, version', [
+    ('NuGet', '2.0.0', '2.0'),
+    ('Maven', '4.3.30', '4.3.30.RELEASE'),
+    ('RubyGems', '1.1', '1.1.0'),
+])
+def test_fixed_version_is_not_affected(ecosystem, fixed, version):
+    index = depscan.IntervalIndex(ecosystem)
+    index.add('0', fixed, None, 'GHSA-test')
+    index.freeze()
+    assert index.lookup(version) == []
+    assert index.lookup('1.0') == [(fixed, 'GHSA-test')]
+
+
+def test_normalize_package_name():
+    assert normalize_package_name('PyPI', 'Django_Foo.bar') == 'django-foo-bar'
+    assert normalize_package_name('NuGet', 'Newtonsoft.Json') == 'newtonsoft.json'
+    assert normalize_package_name('npm', 'React') == 'React'
@@ -1,3 +1,8 @@
+import hashlib
+import time
+import zlib
+from itertools import islice
+
 
 # https://stackoverflow.com/a/52447759
 def get_path(data, path, default=None):
@@ -19,15 +24,53 @@ def str_to_date(date_str):
         return None
 
 
-def remove_duplicates(lst: list):
-    seen = []
+def remove_duplicates(lst: list, key=None):
+    """Removes duplicates while keeping the original order.
+    `key` maps an item to a hashable identity (defaults to the item itself)"""
+    seen = set()
+    unique = []
     for item in lst:
-        found = False
-        for seen_item in seen:
-            if item == seen_item:
-                found = True
+        identity = key(item) if key is not None else item
+        if identity not in seen:
+            seen.add(identity)
+            unique.append(item)
+
+    return unique
+
+
+def chunks(iterable, size: int):
+    """Yields lists of at most `size` items (e.g. to keep IN (...) lists under SQLite's variable limit)"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def compress_text(value: str) -> bytes:
+    return zlib.compress(value.encode('utf-8'))
+
+
+def decompress_text(value: bytes | None) -> str | None:
+    return zlib.decompress(value).decode('utf-8') if value is not None else None
+
+
+def file_sha256(path: str) -> str:
+    """Hashes a file in blocks, so large files are never read into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
-        if not found:
-            seen.append(item)
+def report_first_response(server, started_at: float, name: str):
+    """Prints how long the flask `server` took from `started_at` (a time.perf_counter() taken
+    at process start) to sending its first response"""
+    reported = False
 
-    return seen
+    @server.after_request
+    def _report(response):
+        nonlocal reported
+        if not reported:
+            reported = True
+            print(f"{name}: first response sent {time.perf_counter() - started_at:.2f}s after start")
+        return response
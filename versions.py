@@ -0,0 +1,72 @@
+import re
+
+from packaging.version import Version, InvalidVersion
+
+# Ecosystem-aware package name normalization and version ordering, used by the ingest (name keys)
+# and by depscan (matching dependency versions against affected ranges).
+# Kept free of flask/sqlalchemy imports, the ingest's parser worker processes import it.
+
+SEMVER_PATTERN = re.compile(r'^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+TOKEN_PATTERN = re.compile(r'\d+|[a-z]+')
+
+# Ecosystems whose advisories use semver ordering (Go versions are semver with a "v" prefix)
+SEMVER_ECOSYSTEMS = {'npm', 'Go', 'crates.io', 'Hex', 'Pub', 'SwiftURL'}
+MAVEN_RELEASE_QUALIFIERS = {'release', 'final', 'ga'}
+
+
+def normalize_package_name(ecosystem: str, name: str) -> str:
+    """The key packages are matched on, e.g. PyPI treats Django_Foo and django.foo as the same project"""
+    if ecosystem == 'PyPI':
+        return re.sub(r'[-_.]+', '-', name).lower()
+    if ecosystem in ('NuGet', 'Packagist', 'crates.io'):
+        return name.lower()
+    return name
+
+def version_key(ecosystem: str, version: str):
+    """Returns a sortable key for `version` following the ecosystem's ordering rules.
+    Keys are only comparable with other keys of the same ecosystem"""
+    version = version.strip()
+    if ecosystem == 'PyPI':
+        try:
+            return (0, Version(version))
+        except InvalidVersion:
+            pass
+    elif ecosystem in SEMVER_ECOSYSTEMS:
+        key = semver_key(version)
+        if key is not None:
+            return (1, key)
+    return (2, generic_key(version, ecosystem))
+
+def semver_key(version: str):
+    match = SEMVER_PATTERN.match(version)
+    if match is None:
+        return None
+    major, minor, patch, prerelease = match.groups()
+    release = (int(major), int(minor or 0), int(patch or 0))
+    if prerelease is None:
+        return release + (1, ())
+    # Pre-releases sort before the release, numeric identifiers before alphanumeric ones
+    identifiers = tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in prerelease.split('.'))
+    return release + (0, identifiers)
+
+def generic_key(version: str, ecosystem: str | None = None):
+    """Best effort ordering for the other ecosystems (Maven, RubyGems, NuGet, Packagist, ...): numbers compare
+    numerically, and a trailing word (beta, rc, ...) sorts before the plain release. Trailing zeros don't
+    count (1.0 == 1.0.0, 1.0-beta == 1.0.0-beta), and Maven's release/final/ga qualifiers are the plain release"""
+    key = []
+    for token in TOKEN_PATTERN.findall(version.lower().lstrip('v')):
+        if token.isdigit():
+            key.append((2, int(token), ''))
+            continue
+        if ecosystem == 'Maven' and token in MAVEN_RELEASE_QUALIFIERS:
+            continue
+        strip_zeros(key)
+        key.append((0, 0, token))
+    strip_zeros(key)
+    key.append((1, 0, '')) # End marker: 1.0 < 1.0.1 but 1.0-beta < 1.0
+    return tuple(key)
+
+def strip_zeros(key: list):
+    """Drops the zero numbers at the end of the key, keeping the first number of the version"""
+    while len(key) > 1 and key[-1] == (2, 0, '') and key[-2][0] == 2:
+        key.pop()
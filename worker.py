@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import read_db
+
+# The database update (git sync + ingest) as its own process, so the web server never runs it.
+# A lock file makes sure only one run happens at a time however many web workers schedule it, and
+# each run writes its stage and result to a status file the app serves at /api/update-status.
+#
+#   python worker.py           # update now, exits right away if another update is running
+#   python worker.py --profile update.prof    # same, with a cProfile dump of this process (not the parser pool)
+
+INSTANCE_PATH = os.path.dirname(read_db.DB_FILE)
+LOCK_PATH = os.path.join(INSTANCE_PATH, 'update.lock')
+STATUS_PATH = os.path.join(INSTANCE_PATH, 'update-status.json')
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+EXIT_FAILED = 1
+EXIT_LOCKED = 2
+STATUS_INTERVAL = 1.0 # seconds between progress writes while advisories are loaded
+
+if os.name == 'nt':
+    import ctypes
+    import msvcrt
+
+    def _lock(f) -> bool:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _is_running(pid: int) -> bool:
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == 259 # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+else:
+    import fcntl
+
+    def _lock(f) -> bool:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _is_running(pid: int) -> bool:
+        try:
+            os.kill(pid, 0) # Signal 0 only checks that the process exists
+        except ProcessLookupError:
+            return False
+        except PermissionError: # It exists, under another user
+            return True
+        return True
+
+
+def acquire_lock():
+    """Returns the open lock file if this process now holds the update lock, None if another one does.
+    The OS releases the lock when the process exits, even if it crashes"""
+    os.makedirs(INSTANCE_PATH, exist_ok=True)
+    f = open(LOCK_PATH, 'a+')
+    if _lock(f):
+        return f
+    f.close()
+    return None
+
+def read_status() -> dict:
+    """The status of the current or last update run ({} if there never was one)"""
+    try:
+        with open(STATUS_PATH, encoding='utf-8') as f:
+            status = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if status.get('state') == 'running' and not _is_running(status['pid']):
+        # A worker that was killed never got to write its result. Checked by pid rather than by taking
+        # the lock, a worker starting at that moment would find the lock taken and skip its run
+        status['state'] = 'interrupted'
+    return status
+
+def write_status(status: dict):
+    # Written to a temporary file and renamed, readers never see half a file
+    tmp_path = STATUS_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, STATUS_PATH)
+
+def now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def run_update() -> int:
+    """Runs one update under the lock, returns the process exit code"""
+    lock = acquire_lock()
+    if lock is None:
+        print("Another update is already running, skipping this one.")
+        return EXIT_LOCKED
+
+    # Imported here so a worker that finds the lock taken exits without loading the app's modules
+    import database
+
+    try:
+        previous = read_status()
+        status = {
+            'state': 'running', 'stage': 'starting', 'advisories_written': 0, 'pid': os.getpid(),
+            'started_at': now(), 'finished_at': None, 'error': None,
+            'last_success_at': previous.get('last_success_at'),
+        }
+        write_status(status)
+        written_at = 0.0
+
+        def progress(stage, advisories_written=None):
+            nonlocal written_at
+            changed = stage != status['stage']
+            status['stage'] = stage
+            if advisories_written is not None:
+                status['advisories_written'] = advisories_written
+            if changed or time.monotonic() - written_at >= STATUS_INTERVAL:
+                write_status(status)
+                written_at = time.monotonic()
+
+        try:
+            rebuilt = database.update_db(progress)
+        except Exception as e:
+            print(f"{e}", file=sys.stderr)
+            status.update(state='failed', finished_at=now(), error=str(e))
+            write_status(status)
+            return EXIT_FAILED
+
+        status.update(state='succeeded' if rebuilt else 'up-to-date', stage='done', finished_at=now())
+        status['last_success_at'] = status['finished_at']
+        write_status(status)
+        return 0
+    finally:
+        lock.close()
+
+def run_in_subprocess() -> bool:
+    """Runs an update in a worker process and waits for it, for the app's scheduler.
+    Returns False if the update failed (a run skipped because another one holds the lock counts as fine)"""
+    result = subprocess.run([sys.executable, WORKER_SCRIPT])
+    return result.returncode in (0, EXIT_LOCKED)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Syncs the advisory repo and updates the database")
+    parser.add_argument('--profile', metavar='FILE', help="Write a cProfile dump of the run to FILE "
+                        "(view it with `python -m pstats FILE`)")
+    args = parser.parse_args()
+
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        exit_code = profiler.runcall(run_update)
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+        sys.exit(exit_code)
+    sys.exit(run_update())